@@ -1,7 +1,19 @@
-import os, re, time, configparser, requests, logging, shutil, threading, base64, hashlib, bencodepy
-from bs4 import BeautifulSoup
+import os, time, configparser, logging, threading, base64, functools
 from requests.auth import HTTPBasicAuth
 import http.server, socketserver, socket, base64
+from pipeline import TorrentPipeline, pipeline_settings, read_bandwidth
+from downloader import ProgressReporter
+from transfers import TransferScheduler
+from file_rules import FileRules
+from publisher import LibraryPublisher
+from library_index import LibraryIndex
+from watcher import FolderWatcher
+from feed_fetcher import FeedFetcher
+from rom_server import RomServer, HiddenEntriesMixin, is_hidden
+from shop_index import ShopIndex
+from stats import StatsStore
+from alldebrid_client import AllDebridClient, LIMITER, API_URL
+import metrics
 
 # === CONFIG LOADING ===
 config = configparser.ConfigParser()
@@ -19,8 +31,32 @@ fetch_id = config.get('KEY', 'id')
 tinfoil_port = config.getint('TINFOIL', 'port', fallback=9000)
 tinfoil_user = config.get('TINFOIL', 'user', fallback='tinfoil')
 tinfoil_pass = config.get('TINFOIL', 'pass', fallback='roms123')
-
-server = "http://switch4pda.ru:8878"
+tinfoil_mode = config.get('TINFOIL', 'server', fallback='threaded')
+tinfoil_workers = config.getint('TINFOIL', 'workers', fallback=16)
+tinfoil_per_client = config.getint('TINFOIL', 'per_client', fallback=2)
+tinfoil_index = config.get('TINFOIL', 'index', fallback='json')
+tinfoil_proxies = [p.strip() for p in config.get('TINFOIL', 'trusted_proxies', fallback='').split(',') if p.strip()]
+stats_db = config.get('STATS', 'db', fallback='stats.db')
+stats_flush = config.getfloat('STATS', 'flush_interval', fallback=5)
+metrics.REGISTRY.enabled = config.getboolean('METRICS', 'enabled', fallback=False)
+
+stage_in_library = config.getboolean('DOWNLOAD', 'stage_in_library', fallback=True)
+max_transfers = config.getint('TRANSFERS', 'max_transfers', fallback=4)
+per_host = config.getint('TRANSFERS', 'per_host', fallback=8)
+progress_interval = config.getfloat('DOWNLOAD', 'progress_interval', fallback=1)
+watch_mode = config.get('WATCH', 'mode', fallback='auto')
+watch_settle = config.getfloat('WATCH', 'settle', fallback=1.0)
+watch_poll = config.getfloat('WATCH', 'poll_interval', fallback=5)
+watch_rescan = config.getfloat('WATCH', 'rescan_interval', fallback=60)
+remote_interval = config.getfloat('REMOTE', 'interval', fallback=30)
+remote_workers = config.getint('REMOTE', 'workers', fallback=4)
+remote_retries = config.getint('REMOTE', 'retries', fallback=3)
+remote_state = config.get('REMOTE', 'state_file', fallback='feed_state.json')
+
+LIMITER.configure(config.getfloat('API', 'per_second', fallback=12), config.getfloat('API', 'per_minute', fallback=600))
+client = AllDebridClient(apikey, config.get('API', 'url', fallback=API_URL))
+
+server = config.get('REMOTE', 'url', fallback="http://switch4pda.ru:8878")
 log_file = config.get('GENERAL', 'log_file', fallback='alldebrid.log')
 
 LOG = logging.getLogger("AllDebridUnified")
@@ -38,174 +74,56 @@ for folder in [watch_folder, complete_folder, downloads_folder, library_folder]:
     except Exception as e:
         LOG.warning(f"⚠️ Failed to create folder {folder}: {e}")
 
-def extract_rom_tag(filename):
-    match = re.search(r"\[([0-9A-F]{16})\]\[v(\d+)\]", filename, re.IGNORECASE)
-    if match:
-        return f"[{match.group(1)}][v{match.group(2)}]"
-    return None
-
-def extract_rom_tag_from_torrent(path):
-    try:
-        with open(path, 'rb') as f:
-            meta = bencodepy.decode(f.read())
-        info = meta[b'info']
-        rom_tags = []
-        if b'files' in info:
-            for file in info[b'files']:
-                for part in file[b'path']:
-                    tag = extract_rom_tag(part.decode(errors='ignore'))
-                    if tag:
-                        rom_tags.append(tag)
-        else:
-            name = info.get(b'name', b'').decode(errors='ignore')
-            tag = extract_rom_tag(name)
-            if tag:
-                rom_tags.append(tag)
-        return rom_tags[0] if rom_tags else None
-    except Exception as e:
-        LOG.error(f"❌ Failed to extract ROM tag: {e}")
-        return None
-
-def is_duplicate_from_tag(tag):
-    for file in os.listdir(library_folder):
-        if tag.lower() in file.lower():
-            LOG.info(f"✅ Duplicate ROM detected in library: {file}")
-            return True
-    return False
-
-def torrent_to_magnet(path):
-    try:
-        with open(path, 'rb') as f:
-            meta = bencodepy.decode(f.read())
-        info = meta[b'info']
-        digest = hashlib.sha1(bencodepy.encode(info)).digest()
-        b32hash = base64.b32encode(digest).decode()
-        name = info.get(b'name', b'').decode(errors='ignore')
-        return f"magnet:?xt=urn:btih:{b32hash}&dn={name}", name
-    except Exception as e:
-        LOG.error(f"Torrent conversion failed: {e}")
-        return None, None
-
-def send_magnet(magnet):
-    try:
-        r = requests.get("https://api.alldebrid.com/v4/magnet/upload", params={
-            "apikey": apikey, "magnets[]": magnet
-        })
-        res = r.json()
-        if res["status"] == "success":
-            magnets = res["data"]["magnets"]
-            return magnets[0]["id"] if isinstance(magnets, list) else magnets["id"]
-        LOG.error(f"Magnet rejected: {res}")
-    except Exception as e:
-        LOG.error(f"Send magnet error: {e}")
-    return None
-
-def poll_ready(magnet_id):
-    for _ in range(60):
-        try:
-            r = requests.get("https://api.alldebrid.com/v4/magnet/status", params={
-                "apikey": apikey, "id": magnet_id
-            })
-            res = r.json()
-            if res["status"] == "success":
-                magnet = res["data"]["magnets"]
-                if magnet["status"] == "Ready":
-                    LOG.info("✅ Download is ready.")
-                    return magnet["links"]
-                else:
-                    LOG.info(f"⏳ Status: {magnet['status']}")
-        except Exception as e:
-            LOG.error(f"Poll error: {e}")
-        time.sleep(5)
-    return []
-
-def unlock_and_download(entry):
-    try:
-        r = requests.get("https://api.alldebrid.com/v4/link/unlock", params={
-            "apikey": apikey, "link": entry["link"]
-        })
-        res = r.json()
-        if res["status"] != "success":
-            LOG.error(f"Unlock failed: {res}")
-            return
-        url = res["data"]["link"]
-        name = res["data"]["filename"]
-        size = res["data"].get("filesize", 1)
-        dest = os.path.join(downloads_folder, name)
-
-        with requests.get(url, stream=True) as r:
-            with open(dest, 'wb') as f:
-                downloaded = 0
-                start_time = time.time()
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
-                    downloaded += len(chunk)
-                    elapsed = max(time.time() - start_time, 0.1)
-                    speed = downloaded / 1024 / 1024 / elapsed
-                    eta = (size - downloaded) / (downloaded / elapsed + 0.1)
-                    percent = (downloaded / size) * 100
-                    print(f"\r⬇️ {name} {percent:.1f}% at {speed:.2f} MB/s | ETA: {eta:.1f}s", end='', flush=True)
-
-        print()
-        LOG.info(f"✅ Finished: {name} | Speed: {speed:.2f} MB/s | Size: {size / (1024 * 1024):.2f} MB")
-
-        if name.lower().endswith(('.nsp', '.nsz', '.xci', '.xcz')):
-            final_path = os.path.join(library_folder, name)
-            shutil.move(dest, final_path)
-            LOG.info(f"📁 Moved to library: {final_path}")
-        else:
-            os.remove(dest)
-            LOG.info(f"🧹 Deleted non-ROM file: {name}")
-    except Exception as e:
-        LOG.error(f"Download failed: {e}")
+library = LibraryIndex(library_folder, LOG)
+rules = FileRules.from_config(config, library)
+shop = ShopIndex(library_folder, log=LOG, extensions=rules.extensions)
+publisher = LibraryPublisher(library_folder, downloads_folder, stage_in_library, LOG)
+
+def show_progress(line):
+    print(f"\r{line}", end='', flush=True)
+
+reporter = ProgressReporter(show_progress, progress_interval)
+transfers = TransferScheduler(max_transfers, per_host, read_bandwidth(), LOG)
+pipeline = TorrentPipeline(client, library, rules, publisher, transfers, reporter, complete_folder,
+                           pipeline_settings(config), LOG, on_published=shop.add, end_line=print)
+
+# Queue depths are read when /metrics is scraped; before process_torrents() has built
+# the pipeline the lookups fail and the gauge is simply left out.
+metrics.gauge('alldebrid_jobs_active', "Torrent jobs in the pipeline", fn=lambda: pipeline.scheduler.pending())
+metrics.gauge('alldebrid_jobs_queued', "Jobs waiting for a pipeline worker", fn=lambda: pipeline.scheduler.queue.qsize())
+metrics.gauge('alldebrid_magnets_waiting', "Magnets polled until Ready", fn=lambda: pipeline.poller.active())
+metrics.gauge('alldebrid_magnets_to_upload', "Jobs waiting for the next upload batch",
+              fn=lambda: len(pipeline.uploader.pending))
+metrics.gauge('alldebrid_transfers_queued', "File transfers waiting for a slot", fn=lambda: transfers.pending())
+metrics.gauge('alldebrid_jobs_waiting_for_space', "Jobs queued until there is disk space",
+              fn=lambda: pipeline.space.pending())
 
 def process_torrents():
-    LOG.info("📡 Torrent processor started...")
-    while True:
-        for f in os.listdir(watch_folder):
-            if f.endswith('.torrent') and not f.endswith('.processed.torrent'):
-                full = os.path.join(watch_folder, f)
-                LOG.info(f"📄 Found torrent: {f}")
-                tag = extract_rom_tag_from_torrent(full)
-                if tag and is_duplicate_from_tag(tag):
-                    LOG.info(f"⚠️ Duplicate detected: {tag} — skipping.")
-                    os.remove(full)
-                    continue
-                magnet, name = torrent_to_magnet(full)
-                if magnet:
-                    mid = send_magnet(magnet)
-                    if mid:
-                        links = poll_ready(mid)
-                        threads = [threading.Thread(target=unlock_and_download, args=(link,)) for link in links]
-                        [t.start() for t in threads]
-                        [t.join() for t in threads]
-                        shutil.move(full, os.path.join(complete_folder, f))
-        time.sleep(5)
+    LOG.info(f"📡 Torrent processor started ({pipeline.settings['threads']} workers)...")
+    pipeline.start()
+    FolderWatcher(watch_folder, pipeline.submit, LOG, settle=watch_settle, poll_interval=watch_poll,
+                  rescan_interval=watch_rescan, mode=watch_mode).run()
+
+def remote_torrent_name(text):
+    parts = text.split("_&&_")
+    if fetch_id in text and fetch_key in text and len(parts) > 2:
+        return parts[2].replace(" ", "_")
+    return None
 
 def watch_remote_server():
     LOG.info("🌐 Remote torrent fetcher started...")
-    while True:
-        try:
-            html = requests.get(server, auth=HTTPBasicAuth("user", fetch_key)).text
-            soup = BeautifulSoup(html, "html.parser")
-            for a in soup.find_all('a', href=True):
-                name = a.text
-                if fetch_id in name and fetch_key in name:
-                    file = os.path.join(watch_folder, name.split("_&&_")[2].replace(" ", "_"))
-                    if not os.path.exists(file):
-                        link = f"{server}/{a['href']}"
-                        with requests.get(link, auth=HTTPBasicAuth("user", fetch_key), stream=True) as r:
-                            with open(file, 'wb') as f:
-                                for chunk in r.iter_content(8192):
-                                    f.write(chunk)
-                        LOG.info(f"✅ Downloaded remote torrent: {os.path.basename(file)}")
-        except Exception as e:
-            LOG.error(f"⚠️ Remote fetch error: {e}")
-        time.sleep(30)
-
-class AuthHandler(http.server.SimpleHTTPRequestHandler):
-    def do_HEAD(self): return self.auth_check() and super().do_HEAD()
-    def do_GET(self): return self.auth_check() and super().do_GET()
+    FeedFetcher(server, watch_folder, remote_torrent_name, pipeline.submit, HTTPBasicAuth("user", fetch_key),
+                remote_state, LOG, remote_workers, remote_retries, known=(complete_folder,)).run(remote_interval)
+
+class AuthHandler(HiddenEntriesMixin, http.server.SimpleHTTPRequestHandler):
+    def do_HEAD(self): return self.auth_check() and self.visible() and super().do_HEAD()
+    def do_GET(self):
+        if not self.auth_check() or not self.visible():
+            return False
+        super().do_GET()
+        path = self.translate_path(self.path)
+        if stats and os.path.isfile(path):
+            stats.record(self.client_address[0], path, os.path.getsize(path))
     def auth_check(self):
         auth = self.headers.get('Authorization')
         expected = f"{tinfoil_user}:{tinfoil_pass}"
@@ -217,15 +135,35 @@ class AuthHandler(http.server.SimpleHTTPRequestHandler):
             self.wfile.write(b"Unauthorized")
             return False
         return True
+    def visible(self):
+        # Half-written downloads in the library's staging folder stay out of reach.
+        if is_hidden(self.directory, self.translate_path(self.path)):
+            self.send_error(404, "File not found")
+            return False
+        return True
 
 def get_local_ip():
     try: return socket.gethostbyname(socket.gethostname())
     except: return 'localhost'
 
+stats = None
+
 def start_tinfoil_server():
-    os.chdir(library_folder)
-    with socketserver.TCPServer(("", tinfoil_port), AuthHandler) as httpd:
-        LOG.info(f"🛰️ Tinfoil server running at http://{get_local_ip()}:{tinfoil_port}/ (auth enabled)")
+    global stats
+    stats = StatsStore(stats_db, stats_flush, log=LOG).start()
+    if tinfoil_mode == 'simple':
+        handler = functools.partial(AuthHandler, directory=library_folder)
+        with socketserver.TCPServer(("", tinfoil_port), handler) as httpd:
+            LOG.info(f"🛰️ Tinfoil server running at http://{get_local_ip()}:{tinfoil_port}/ (auth enabled)")
+            httpd.serve_forever()
+    shop.build().watch()
+    shop_paths = ('/shop.json', '/') if tinfoil_index == 'json' else ('/shop.json',)
+    with RomServer(("", tinfoil_port), library_folder, tinfoil_user, tinfoil_pass,
+                   tinfoil_workers, tinfoil_per_client, LOG, shop=shop, shop_paths=shop_paths, stats=stats,
+                   metrics=metrics.REGISTRY if metrics.REGISTRY.enabled else None,
+                   trusted_proxies=tinfoil_proxies) as httpd:
+        LOG.info(f"🛰️ Tinfoil server running at http://{get_local_ip()}:{tinfoil_port}/ "
+                 f"(auth enabled, {tinfoil_workers} transfers, {tinfoil_per_client} per client)")
         httpd.serve_forever()
 
 # === MAIN THREAD SAFE EXIT ===
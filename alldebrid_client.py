@@ -0,0 +1,136 @@
+import time, threading, requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import metrics
+
+API_URL = "https://api.alldebrid.com/v4"
+
+# (connect, read) seconds
+API_TIMEOUT = (10, 30)
+DOWNLOAD_TIMEOUT = (10, 60)
+
+# AllDebrid allows 12 requests per second and 600 per minute per key
+PER_SECOND = 12
+PER_MINUTE = 600
+
+API_SECONDS = metrics.histogram('alldebrid_api_request_seconds', "AllDebrid API latency by endpoint and status",
+                                ('endpoint', 'status'))
+
+
+class AllDebridError(Exception):
+    def __init__(self, error):
+        if not isinstance(error, dict):
+            error = {"message": str(error)}
+        self.code = error.get("code", "UNKNOWN")
+        self.message = error.get("message", "")
+        super().__init__(f"{self.code}: {self.message}")
+
+
+class TokenBucket:
+    # Blocking token bucket. A request for more tokens than the bucket holds is let
+    # through once the bucket is full and leaves it in debt, so large byte counts
+    # can be metered too. rate <= 0 means unlimited.
+    def __init__(self, rate, capacity=None):
+        self.lock = threading.Lock()
+        self.set_rate(rate, capacity)
+        self.tokens = self.capacity
+
+    def set_rate(self, rate, capacity=None):
+        with self.lock:
+            self.rate = float(rate)
+            self.capacity = float(capacity if capacity is not None else max(self.rate, 1))
+            self.stamp = time.monotonic()
+            self.tokens = min(getattr(self, "tokens", self.capacity), self.capacity)
+
+    def acquire(self, n=1):
+        while True:
+            with self.lock:
+                if self.rate <= 0:
+                    return
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+                self.stamp = now
+                if self.tokens >= min(n, self.capacity):
+                    self.tokens -= n
+                    return
+                wait = (min(n, self.capacity) - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class RateLimiter:
+    def __init__(self, per_second=PER_SECOND, per_minute=PER_MINUTE):
+        self.buckets = [TokenBucket(per_second, per_second), TokenBucket(per_minute / 60.0, per_minute)]
+
+    def configure(self, per_second, per_minute):
+        self.buckets[0].set_rate(per_second, per_second)
+        self.buckets[1].set_rate(per_minute / 60.0, per_minute)
+
+    def acquire(self):
+        for bucket in self.buckets:
+            bucket.acquire()
+
+
+# Process-wide: every client and worker thread draws from the same limits.
+LIMITER = RateLimiter()
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def make_session(pool_size=32, retries=4, backoff=1.0):
+    s = requests.Session()
+    retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=None, respect_retry_after_header=True, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    s.mount('http://', adapter)
+    s.mount('https://', adapter)
+    return s
+
+
+def session():
+    # Shared keep-alive session for API calls, file hosts and the torrent feed.
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = make_session()
+        return _session
+
+
+class AllDebridClient:
+    def __init__(self, apikey, base_url=API_URL, limiter=None, timeout=API_TIMEOUT):
+        self.apikey = apikey
+        self.base_url = base_url.rstrip('/')
+        self.limiter = limiter or LIMITER
+        self.timeout = timeout
+
+    def request(self, method, endpoint, data=None, **params):
+        self.limiter.acquire()
+        started, status = time.perf_counter(), "error"
+        try:
+            r = session().request(method, f"{self.base_url}/{endpoint}", params={"apikey": self.apikey, **params},
+                                  data=data, timeout=self.timeout)
+            status = str(r.status_code)
+            res = r.json()
+        finally:
+            API_SECONDS.labels(endpoint, status).observe(time.perf_counter() - started)
+        if res.get("status") != "success":
+            raise AllDebridError(res.get("error", res))
+        return res["data"]
+
+    def get(self, endpoint, **params):
+        return self.request("GET", endpoint, **params)
+
+    def post(self, endpoint, data=None, **params):
+        return self.request("POST", endpoint, data=data, **params)
+
+    def upload_magnets(self, magnets):
+        uploaded = self.post("magnet/upload", data={"magnets[]": list(magnets)})["magnets"]
+        return uploaded if isinstance(uploaded, list) else [uploaded]
+
+    def magnet_status(self, magnet_id=None):
+        params = {"id": magnet_id} if magnet_id is not None else {}
+        magnets = self.get("magnet/status", **params)["magnets"]
+        return magnets if isinstance(magnets, list) else [magnets]
+
+    def unlock(self, link):
+        return self.get("link/unlock", link=link)
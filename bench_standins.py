@@ -0,0 +1,301 @@
+import os, re, json, time, random, base64, hashlib, threading, http.server
+from urllib.parse import urlsplit, parse_qs, unquote, quote
+import bencodepy
+
+MB = 1024 * 1024
+
+
+class Faults:
+    # Latency, bandwidth and failure injection shared by every stand-in. `latency` is
+    # added before each response, `bandwidth` (bytes/s, 0 = unlimited) paces each
+    # response body and `fail_rate` is the chance a request is answered with a 503.
+    def __init__(self, latency=0.0, bandwidth=0, fail_rate=0.0, seed=None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.fail_rate = fail_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def fails(self):
+        with self.lock:
+            return self.fail_rate and self.random.random() < self.fail_rate
+
+
+class StandInServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, handler, faults=None):
+        self.faults = faults or Faults()
+        self.calls = {}
+        self.calls_lock = threading.Lock()
+        super().__init__(("127.0.0.1", 0), handler)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def count(self, name):
+        with self.calls_lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name=type(self).__name__, daemon=True).start()
+        return self
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def inject(self, name):
+        # Counts the call and applies latency/failures; False means a 503 was sent.
+        self.server.count(name)
+        faults = self.server.faults
+        if faults.latency:
+            time.sleep(faults.latency)
+        if faults.fails():
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return False
+        return True
+
+    def send_body(self, status, body, headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.write_paced(body)
+
+    def write_paced(self, data):
+        bandwidth = self.server.faults.bandwidth
+        if not bandwidth:
+            return self.wfile.write(data)
+        step = max(16384, bandwidth // 20)
+        started = time.monotonic()
+        for sent in range(0, len(data), step):
+            self.wfile.write(data[sent:sent + step])
+            ahead = (sent + step) / bandwidth - (time.monotonic() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+
+
+def btih_hex(magnet):
+    # info-hash of a magnet URI as lowercase hex (accepts hex or base32 btih).
+    match = re.search(r"xt=urn:btih:([A-Za-z0-9]+)", magnet or '')
+    if not match:
+        return None
+    value = match.group(1)
+    if len(value) == 32:
+        return base64.b32decode(value.upper()).hex()
+    return value.lower()
+
+
+class FakeAllDebrid(StandInServer):
+    # /v4/magnet/upload, /v4/magnet/status and /v4/link/unlock. A magnet turns Ready
+    # `ready_delay` seconds after upload; its links are whatever files were registered
+    # for its info-hash, and unlocking points at the file host.
+    def __init__(self, file_host, faults=None, ready_delay=1.0):
+        self.file_host = file_host
+        self.ready_delay = ready_delay
+        self.torrents = {}
+        self.magnets = {}
+        self.by_hash = {}
+        self.lock = threading.Lock()
+        self.next_id = 1000
+        super().__init__(AllDebridHandler, faults)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v4"
+
+    def register(self, info_hash, files):
+        self.torrents[info_hash] = files
+
+    def upload(self, uri):
+        info_hash = btih_hex(uri)
+        if info_hash not in self.torrents:
+            return {"magnet": uri, "error": {"code": "MAGNET_INVALID_URI", "message": "unknown magnet"}}
+        with self.lock:
+            mid = self.by_hash.get(info_hash)
+            if mid is None:
+                mid = self.by_hash[info_hash] = self.next_id
+                self.next_id += 1
+                self.magnets[mid] = {"hash": info_hash, "uploaded": time.time()}
+        return {"magnet": uri, "hash": info_hash, "id": mid, "name": info_hash, "ready": self.ready_delay <= 0}
+
+    def status(self, mid):
+        magnet = self.magnets[mid]
+        files = self.torrents[magnet["hash"]]
+        total = sum(size for _, size in files)
+        progress = min(1.0, (time.time() - magnet["uploaded"]) / self.ready_delay) if self.ready_delay > 0 else 1.0
+        entry = {"id": mid, "hash": magnet["hash"], "filename": magnet["hash"], "size": total,
+                 "downloaded": int(total * progress),
+                 "downloadSpeed": int(total / self.ready_delay) if progress < 1 else 0}
+        if progress < 1:
+            entry.update(status="Downloading", statusCode=1)
+        else:
+            entry.update(status="Ready", statusCode=4,
+                         links=[{"link": f"{self.file_host.url}/l/{quote(name)}", "filename": name, "size": size}
+                                for name, size in files])
+        return entry
+
+
+class AllDebridHandler(StandInHandler):
+    def do_GET(self):
+        self.dispatch(parse_qs(urlsplit(self.path).query))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        form = parse_qs(self.rfile.read(length).decode())
+        query = parse_qs(urlsplit(self.path).query)
+        self.dispatch({**query, **form})
+
+    def dispatch(self, params):
+        endpoint = urlsplit(self.path).path.rstrip('/').split('/v4/', 1)[-1]
+        if not self.inject(endpoint):
+            return
+        fake = self.server
+        if endpoint == "magnet/upload":
+            data = {"magnets": [fake.upload(uri) for uri in params.get("magnets[]", [])]}
+        elif endpoint == "magnet/status":
+            with fake.lock:
+                ids = list(fake.magnets)
+            if "id" in params:
+                ids = [int(params["id"][0])]
+            data = {"magnets": [fake.status(mid) for mid in ids]}
+        elif endpoint == "link/unlock":
+            link = params.get("link", [""])[0]
+            name = unquote(link.rsplit('/l/', 1)[-1])
+            size = fake.file_host.size(name)
+            if size is None:
+                return self.reply({"status": "error", "error": {"code": "LINK_DOWN", "message": "unknown link"}})
+            data = {"link": f"{fake.file_host.url}/f/{quote(name)}", "filename": name, "filesize": size}
+        else:
+            return self.send_body(404, b"{}")
+        self.reply({"status": "success", "data": data})
+
+    def reply(self, payload):
+        self.send_body(200, json.dumps(payload).encode(), [('Content-Type', 'application/json')])
+
+
+class FileHost(StandInServer):
+    # Range-capable host for the unlocked download links, serving files from `folder`.
+    def __init__(self, folder, faults=None):
+        self.folder = folder
+        self.bytes_sent = 0
+        super().__init__(FileHostHandler, faults)
+
+    def size(self, name):
+        try:
+            return os.path.getsize(os.path.join(self.folder, os.path.basename(name)))
+        except OSError:
+            return None
+
+
+class FileHostHandler(StandInHandler):
+    def do_GET(self):
+        if not self.inject("file"):
+            return
+        name = os.path.basename(unquote(urlsplit(self.path).path))
+        path = os.path.join(self.server.folder, name)
+        if not os.path.isfile(path):
+            return self.send_body(404, b"")
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            self.send_response(206)
+            self.send_header('Content-Range', f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        with open(path, 'rb') as f:
+            f.seek(start)
+            left = end - start + 1
+            while left:
+                chunk = f.read(min(MB, left))
+                if not chunk:
+                    break
+                self.write_paced(chunk)
+                left -= len(chunk)
+                with self.server.calls_lock:
+                    self.server.bytes_sent += len(chunk)
+
+
+class FeedServer(StandInServer):
+    # The remote index page: one anchor per torrent named "<id>_&&_<key>_&&_<name>",
+    # with an ETag so conditional requests can be answered with 304.
+    def __init__(self, fetch_id, fetch_key, faults=None):
+        self.fetch_id = fetch_id
+        self.fetch_key = fetch_key
+        self.torrents = {}
+        self.lock = threading.Lock()
+        super().__init__(FeedHandler, faults)
+
+    def publish(self, name, data):
+        with self.lock:
+            self.torrents[name] = data
+
+    def page(self):
+        with self.lock:
+            names = sorted(self.torrents)
+        body = "<html><body>\n" + "".join(
+            f'<a href="t/{quote(name)}">{self.fetch_id}_&amp;&amp;_{self.fetch_key}_&amp;&amp;_{name}</a><br>\n'
+            for name in names) + "</body></html>\n"
+        return body.encode()
+
+
+class FeedHandler(StandInHandler):
+    def do_GET(self):
+        path = unquote(urlsplit(self.path).path)
+        if path.startswith('/t/'):
+            if not self.inject("torrent"):
+                return
+            data = self.server.torrents.get(path[3:])
+            return self.send_body(200 if data else 404, data or b"")
+        if not self.inject("index"):
+            return
+        body = self.server.page()
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            return self.send_body(304, b"", [('ETag', etag)])
+        self.send_body(200, body, [('Content-Type', 'text/html; charset=utf-8'), ('ETag', etag)])
+
+
+def make_torrent(folder, name, files, piece_length=MB, seed=0):
+    # Writes the content files into `folder` and returns (torrent bytes, info-hash hex).
+    rng = random.Random(seed)
+    hasher_buf = bytearray()
+    pieces = []
+    entries = []
+    for filename, size in files:
+        with open(os.path.join(folder, filename), 'wb') as f:
+            left = size
+            while left:
+                block = rng.randbytes(min(MB, left))
+                f.write(block)
+                hasher_buf += block
+                while len(hasher_buf) >= piece_length:
+                    pieces.append(hashlib.sha1(hasher_buf[:piece_length]).digest())
+                    del hasher_buf[:piece_length]
+                left -= len(block)
+        entries.append({b'length': size, b'path': [filename.encode()]})
+    if hasher_buf:
+        pieces.append(hashlib.sha1(hasher_buf).digest())
+    info = {b'name': name.encode(), b'piece length': piece_length, b'pieces': b''.join(pieces)}
+    if len(entries) == 1:
+        info[b'name'] = files[0][0].encode()
+        info[b'length'] = files[0][1]
+    else:
+        info[b'files'] = entries
+    data = bencodepy.encode({b'announce': b'http://127.0.0.1/announce', b'info': info})
+    return data, hashlib.sha1(bencodepy.encode(info)).hexdigest()
@@ -0,0 +1,243 @@
+import os, sys, json, time, random, base64, socket, shutil, logging, argparse, tempfile, threading, importlib
+import http.client
+from contextlib import redirect_stdout
+from bench_standins import Faults, FakeAllDebrid, FileHost, FeedServer, make_torrent, MB
+
+# Offline end-to-end benchmark: runs alldebrid.py's feed fetcher, torrent pipeline and
+# Tinfoil server against local stand-ins for AllDebrid, the file host and the remote
+# feed, then reports throughput so changes can be compared with a saved baseline.
+#
+#   python benchmark.py --torrents 8 --size-mb 32 --json baseline.json
+#   python benchmark.py --set DOWNLOAD.segments=8 --baseline baseline.json
+
+FETCH_ID, FETCH_KEY = "benchid", "benchkey"
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Offline throughput benchmark for the AllDebrid pipeline")
+    p.add_argument('--torrents', type=int, default=6)
+    p.add_argument('--files', type=int, default=2, help="files per torrent")
+    p.add_argument('--size-mb', type=float, default=16, help="size of each file")
+    p.add_argument('--ready-delay', type=float, default=1.0, help="seconds until an uploaded magnet is Ready")
+    p.add_argument('--api-latency', type=float, default=0.02)
+    p.add_argument('--api-fail', type=float, default=0.0)
+    p.add_argument('--host-latency', type=float, default=0.01)
+    p.add_argument('--host-bandwidth-mb', type=float, default=0, help="per connection, 0 = unlimited")
+    p.add_argument('--host-fail', type=float, default=0.0)
+    p.add_argument('--feed-latency', type=float, default=0.05)
+    p.add_argument('--feed-fail', type=float, default=0.0)
+    p.add_argument('--tinfoil-clients', type=int, default=8)
+    p.add_argument('--tinfoil-seconds', type=float, default=5)
+    p.add_argument('--timeout', type=float, default=600)
+    p.add_argument('--seed', type=int, default=1)
+    p.add_argument('--set', action='append', default=[], metavar="SECTION.option=value",
+                   help="override a config.ini value for the run")
+    p.add_argument('--json', help="write the results to this file")
+    p.add_argument('--baseline', help="compare with results saved by --json")
+    p.add_argument('--keep', action='store_true', help="keep the work directory")
+    p.add_argument('--verbose', action='store_true')
+    return p.parse_args()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def write_config(path, args, api, feed, port):
+    config = {
+        'KEY': {'key': FETCH_KEY, 'id': FETCH_ID, 'allkey': 'bench'},
+        'FOLDERS': {'watch_folder': 'watch', 'download_folder': 'downloads', 'complete_folder': 'complete',
+                    'library_folder': 'library'},
+        'GENERAL': {'log_file': 'alldebrid.log'},
+        # Every benchmark client shares one IP, so the per-client transfer cap is lifted.
+        'TINFOIL': {'port': port, 'user': 'bench', 'pass': 'bench', 'per_client': max(2, args.tinfoil_clients)},
+        'SETTINGS': {'threads': 4, 'jobs_db': 'jobs.db'},
+        'POLL': {'interval': 0.5, 'max_interval': 2},
+        'API': {'url': api.url, 'per_second': 1000, 'per_minute': 60000},
+        'UPLOAD': {'batch_window': 0.5},
+        'REMOTE': {'url': feed.url, 'interval': 1},
+        'STATS': {'db': 'stats.db', 'flush_interval': 1},
+    }
+    for item in args.set:
+        key, value = item.split('=', 1)
+        section, option = key.split('.', 1)
+        config.setdefault(section, {})[option] = value
+    with open(path, 'w', encoding='utf-8') as f:
+        for section, options in config.items():
+            f.write(f"[{section}]\n" + "".join(f"{k} = {v}\n" for k, v in options.items()) + "\n")
+    return config
+
+
+def make_library(host_dir, args, api, feed):
+    size = int(args.size_mb * MB)
+    total = 0
+    for i in range(args.torrents):
+        files = [(f"Bench{i:03d}-{j} [01{i:08X}{j:02X}0000][v0].nsp", size) for j in range(args.files)]
+        data, info_hash = make_torrent(host_dir, f"Bench{i:03d}", files, seed=args.seed * 1000 + i)
+        api.register(info_hash, files)
+        feed.publish(f"bench{i:03d}.torrent", data)
+        total += size * len(files)
+    return total
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def bench_tinfoil(port, library, clients, seconds):
+    # Keep-alive clients mixing conditional /shop.json requests with 1 MB range reads.
+    auth = "Basic " + base64.b64encode(b"bench:bench").decode()
+    files = sorted(f for f in os.listdir(library) if f.endswith('.nsp'))
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def client(n):
+        rng = random.Random(n)
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        etag = None
+        mine = []
+        while time.monotonic() < deadline:
+            headers = {'Authorization': auth}
+            if not files or rng.random() < 0.5:
+                path = '/shop.json'
+                if etag:
+                    headers['If-None-Match'] = etag
+            else:
+                name = rng.choice(files)
+                size = os.path.getsize(os.path.join(library, name))
+                start = rng.randrange(0, max(1, size - MB))
+                path = '/' + name.replace(' ', '%20').replace('[', '%5B').replace(']', '%5D')
+                headers['Range'] = f"bytes={start}-{start + MB - 1}"
+            started = time.perf_counter()
+            try:
+                conn.request('GET', path, headers=headers)
+                r = conn.getresponse()
+                r.read()
+                if path == '/shop.json':
+                    etag = r.getheader('ETag') or etag
+                if r.status >= 400:
+                    raise IOError(r.status)
+                mine.append(time.perf_counter() - started)
+            except Exception:
+                with lock:
+                    errors[0] += 1
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        conn.close()
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=client, args=(n,), daemon=True) for n in range(clients)]
+    started = time.monotonic()
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    elapsed = time.monotonic() - started
+    return {"tinfoil_requests_per_s": len(latencies) / elapsed,
+            "tinfoil_p50_ms": percentile(latencies, 50) * 1000,
+            "tinfoil_p99_ms": percentile(latencies, 99) * 1000,
+            "tinfoil_errors": errors[0]}
+
+
+def run(args):
+    root = tempfile.mkdtemp(prefix="alldebrid-bench-")
+    host_dir, work = os.path.join(root, 'host'), os.path.join(root, 'work')
+    os.makedirs(host_dir)
+    os.makedirs(work)
+    file_host = FileHost(host_dir, Faults(args.host_latency, int(args.host_bandwidth_mb * MB), args.host_fail,
+                                          args.seed)).start()
+    api = FakeAllDebrid(file_host, Faults(args.api_latency, 0, args.api_fail, args.seed), args.ready_delay).start()
+    feed = FeedServer(FETCH_ID, FETCH_KEY, Faults(args.feed_latency, 0, args.feed_fail, args.seed)).start()
+    print(f"🧪 Generating {args.torrents} torrent(s) x {args.files} file(s) x {args.size_mb:g} MB in {root}")
+    payload = make_library(host_dir, args, api, feed)
+
+    port = free_port()
+    write_config(os.path.join(work, 'config.ini'), args, api, feed, port)
+    os.chdir(work)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    app = importlib.import_module('alldebrid')
+    if not args.verbose:
+        for handler in app.LOG.handlers:
+            if not isinstance(handler, logging.FileHandler):
+                handler.setLevel(logging.WARNING)
+        app.reporter.emit = lambda line: None
+
+    started = time.monotonic()
+    threading.Thread(target=app.process_torrents, daemon=True).start()
+    while app.pipeline.scheduler is None:
+        time.sleep(0.05)
+    threading.Thread(target=app.watch_remote_server, daemon=True).start()
+    threading.Thread(target=app.start_tinfoil_server, daemon=True).start()
+
+    complete = os.path.abspath(app.complete_folder)
+    done = 0
+    # The pipeline prints progress straight to stdout; keep the report readable.
+    with redirect_stdout(sys.stdout if args.verbose else open(os.devnull, 'w')):
+        while done < args.torrents and time.monotonic() - started < args.timeout:
+            time.sleep(0.1)
+            done = sum(1 for f in os.listdir(complete) if f.endswith('.torrent'))
+    elapsed = time.monotonic() - started
+    api_calls = sum(api.calls.values())
+    results = {
+        "torrents": args.torrents,
+        "completed": done,
+        "elapsed_s": elapsed,
+        "torrents_per_hour": done / elapsed * 3600,
+        "download_mb_s": file_host.bytes_sent / MB / elapsed,
+        "payload_mb": payload / MB,
+        "api_calls_per_torrent": api_calls / max(1, args.torrents),
+        "api_calls": dict(sorted(api.calls.items())),
+        "feed_calls": dict(sorted(feed.calls.items())),
+    }
+    print(f"⏱️ Pipeline finished {done}/{args.torrents} in {elapsed:.1f}s — benchmarking Tinfoil server")
+    results.update(bench_tinfoil(port, os.path.abspath(app.library_folder), args.tinfoil_clients,
+                                 args.tinfoil_seconds))
+    return root, results
+
+
+def report(results, baseline=None):
+    rows = [("torrents_per_hour", "Torrents/hour", "{:.0f}", 1), ("download_mb_s", "Download MB/s", "{:.1f}", 1),
+            ("api_calls_per_torrent", "API calls/torrent", "{:.1f}", -1),
+            ("tinfoil_requests_per_s", "Tinfoil req/s", "{:.0f}", 1), ("tinfoil_p50_ms", "Tinfoil p50 ms", "{:.1f}", -1),
+            ("tinfoil_p99_ms", "Tinfoil p99 ms", "{:.1f}", -1)]
+    print(f"\n📊 {results['completed']}/{results['torrents']} torrents, {results['payload_mb']:.0f} MB "
+          f"in {results['elapsed_s']:.1f}s")
+    for key, label, fmt, better in rows:
+        line = f"  {label:<20} {fmt.format(results[key]):>10}"
+        if baseline and baseline.get(key):
+            change = (results[key] - baseline[key]) / baseline[key] * 100
+            mark = "✅" if change * better > 2 else "⚠️" if change * better < -2 else "  "
+            line += f"   {fmt.format(baseline[key]):>10} baseline  {change:+6.1f}% {mark}"
+        print(line)
+    print(f"  API calls: {results['api_calls']}   feed: {results['feed_calls']}   "
+          f"Tinfoil errors: {results['tinfoil_errors']}")
+
+
+def main():
+    args = parse_args()
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    output = os.path.abspath(args.json) if args.json else None
+    root, results = run(args)
+    report(results, baseline)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 Results written to {output}")
+    if not args.keep:
+        os.chdir(os.path.dirname(root))
+        shutil.rmtree(root, ignore_errors=True)
+    sys.stdout.flush()
+    # The pipeline and server threads never return on their own.
+    os._exit(0 if results["completed"] == results["torrents"] else 1)
+
+
+if __name__ == "__main__":
+    main()
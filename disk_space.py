@@ -0,0 +1,127 @@
+import os, shutil, threading, logging
+
+GB = 1024 * 1024 * 1024
+
+
+def allocated(path, size):
+    # Bytes of `path` already on disk, so a preallocated .part stops counting against
+    # the reservation it was admitted with.
+    try:
+        st = os.stat(path)
+    except OSError:
+        return 0
+    blocks = getattr(st, 'st_blocks', None)
+    return min(size, blocks * 512 if blocks is not None else st.st_size)
+
+
+class SpaceReserver:
+    # Admission control for downloads. A job is admitted with the files it is about to
+    # write, as (path, size) pairs under the first folder, and only once the free space
+    # on every device involved, less a safety `margin` and whatever admitted jobs have
+    # yet to allocate, covers them. Other folders on another device (the library, when
+    # downloads are copied into it) must have room for the same bytes. Jobs that don't
+    # fit wait in arrival order and are admitted through on_admitted(job) as space is
+    # released or freed on disk; a job larger than the disk itself goes to on_error.
+    def __init__(self, folders, on_admitted, on_error, margin=GB, log=None, interval=30):
+        self.on_admitted = on_admitted
+        self.on_error = on_error
+        self.margin = margin
+        self.log = log or logging.getLogger(__name__)
+        self.interval = interval
+        self.devices = {}
+        for folder in folders:
+            self.devices.setdefault(os.stat(folder).st_dev, folder)
+        self.work = os.stat(folders[0]).st_dev
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.reserved = {}
+        self.waiting = []
+        self.announced = set()
+
+    def start(self):
+        threading.Thread(target=self._run, name="space-reserver", daemon=True).start()
+        return self
+
+    def admit(self, job, files):
+        with self.lock:
+            self.waiting.append((job, list(files)))
+        self.wake.set()
+
+    def release(self, job, path=None):
+        # Drops one file's reservation (once it is written or given up on), or the whole job's.
+        with self.lock:
+            files = self.reserved.get(job.name)
+            if files is None:
+                return
+            if path is None:
+                del self.reserved[job.name]
+            else:
+                files[:] = [f for f in files if f[0] != path]
+        self.wake.set()
+
+    def pending(self):
+        with self.lock:
+            return len(self.waiting)
+
+    def _outstanding(self, files):
+        # Bytes per device still to be written for `files`.
+        need = dict.fromkeys(self.devices, 0)
+        for path, size in files:
+            for dev in need:
+                need[dev] += size - allocated(path, size) if path and dev == self.work else size
+        return need
+
+    def _run(self):
+        while True:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            try:
+                self._admit_waiting()
+            except Exception as e:
+                self.log.error(f"Disk space check failed: {e}")
+
+    def _admit_waiting(self):
+        with self.lock:
+            waiting = list(self.waiting)
+            reserved = [list(files) for files in self.reserved.values()]
+        if not waiting:
+            return
+        usage = {dev: shutil.disk_usage(folder) for dev, folder in self.devices.items()}
+        available = {dev: usage[dev].free - self.margin for dev in self.devices}
+        for files in reserved:
+            for dev, need in self._outstanding(files).items():
+                available[dev] -= need
+        admitted, failed = [], []
+        blocked = False
+        for job, files in waiting:
+            need = self._outstanding(files)
+            short = [dev for dev in self.devices if need[dev] > available[dev]]
+            if not short and not blocked:
+                for dev in self.devices:
+                    available[dev] -= need[dev]
+                admitted.append((job, files))
+                continue
+            too_big = [dev for dev in self.devices if need[dev] > usage[dev].total - self.margin]
+            if too_big:
+                failed.append((job, f"needs {need[too_big[0]] / GB:.1f} GB, larger than "
+                                    f"{self.devices[too_big[0]]} ({usage[too_big[0]].total / GB:.1f} GB)"))
+            elif not blocked:
+                # Nothing queued behind this job is admitted before it, or a run of small
+                # jobs could hold a large one back for good.
+                blocked = True
+                if job.name not in self.announced:
+                    self.announced.add(job.name)
+                    dev = short[0]
+                    self.log.info(f"💾 Waiting for disk space: {job.name} needs {need[dev] / GB:.1f} GB, "
+                                  f"{max(0, available[dev]) / GB:.1f} GB available on {self.devices[dev]}")
+        with self.lock:
+            for job, files in admitted:
+                self.reserved[job.name] = files
+            done = {id(job) for job, _ in admitted + failed}
+            self.waiting = [w for w in self.waiting if id(w[0]) not in done]
+        for job, files in admitted:
+            self.announced.discard(job.name)
+            self.on_admitted(job)
+        for job, reason in failed:
+            self.announced.discard(job.name)
+            self.on_error(job, reason)
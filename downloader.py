@@ -0,0 +1,374 @@
+import os, json, time, errno, threading, logging
+from contextlib import nullcontext
+from alldebrid_client import DOWNLOAD_TIMEOUT, session
+import metrics
+
+MB = 1024 * 1024
+OPEN_FLAGS = os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+
+DOWNLOAD_BYTES = metrics.counter('alldebrid_download_bytes_total', "Bytes received from download hosts")
+DOWNLOADS = metrics.counter('alldebrid_downloads_total', "Finished file downloads by result", ('result',))
+
+
+def pwrite(fd, data, offset, lock=None):
+    # Positioned write; Windows has no os.pwrite so fall back to seek+write under a lock.
+    view = memoryview(data)
+    if hasattr(os, 'pwrite'):
+        while view:
+            n = os.pwrite(fd, view, offset)
+            view = view[n:]
+            offset += n
+        return
+    with lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        while view:
+            view = view[os.write(fd, view):]
+
+
+def preallocate(fd, size):
+    # Reserve the blocks up front so a full disk fails the download before the first
+    # byte rather than part-way through, and the file is laid out contiguously. Without
+    # posix_fallocate (Windows, macOS) or filesystem support, extending the file will do.
+    # On failure (ENOSPC) the file is cut back to nothing instead of keeping whatever
+    # was allocated in a dead .part.
+    fallocate = getattr(os, 'posix_fallocate', None)
+    try:
+        if fallocate:
+            try:
+                return fallocate(fd, 0, size)
+            except OSError as e:
+                if e.errno not in (errno.EINVAL, errno.EOPNOTSUPP, errno.ENOSYS):
+                    raise
+        os.ftruncate(fd, size)
+    except OSError:
+        os.ftruncate(fd, 0)
+        raise
+
+
+def split_ranges(size, segments, min_segment, start=0):
+    # Half-open [start, end) ranges covering start..size.
+    length = size - start
+    count = max(1, min(segments, -(-length // max(1, min_segment))))
+    step = -(-length // count)
+    return [(s, min(s + step, size)) for s in range(start, size, step)]
+
+
+def merge_ranges(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def subtract_ranges(done, cut):
+    result = []
+    for start, end in done:
+        pieces = [[start, end]]
+        for cs, ce in cut:
+            pieces = [p for s, e in pieces for p in ([s, min(e, cs)], [max(s, ce), e]) if p[1] > p[0]]
+        result += pieces
+    return merge_ranges(result)
+
+
+def missing_ranges(done, size):
+    gaps, pos = [], 0
+    for start, end in done:
+        if start > pos:
+            gaps.append((pos, start))
+        pos = max(pos, end)
+    if pos < size:
+        gaps.append((pos, size))
+    return gaps
+
+
+class Download:
+    # Fetches `url` into `dest` by way of `dest.part`, preallocated at full size when
+    # the size is known. When the host honours Range, the missing byte ranges are
+    # fetched in parallel and written straight to their offsets. Completed ranges are
+    # checkpointed to a small journal next to the .part file (after an fsync), so a
+    # killed or failed transfer resumes from the last verified offset; `refresh()` is called for a fresh URL before each
+    # retry. With a PieceVerifier, bytes are hashed against the torrent's pieces as
+    # they stream in and only failed pieces are fetched again. The file is only renamed
+    # to `dest` once its size matches and every checkable piece is good. A
+    # TransferScheduler, if given, caps connections per host and meters bandwidth.
+    def __init__(self, url, dest, size, segments=4, min_segment=16 * MB, chunk_size=MB,
+                 reporter=None, log=None, refresh=None, retries=3, checkpoint=32 * MB, verifier=None,
+                 transfers=None):
+        self.url = url
+        self.dest = dest
+        self.part = dest + '.part'
+        self.journal = dest + '.part.journal'
+        self.size = size if size and size > 1 else 0
+        self.segments = max(1, int(segments))
+        self.min_segment = max(1, int(min_segment))
+        self.chunk_size = chunk_size
+        self.reporter = reporter
+        self.log = log or logging.getLogger(__name__)
+        self.refresh = refresh
+        self.retries = retries
+        self.checkpoint = checkpoint
+        self.verifier = verifier
+        self.transfers = transfers
+        self.name = os.path.basename(dest)
+        self.done = []
+        self.base = 0
+        self.counters = {}
+        self.resumed = 0
+        self.started = None
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+
+    @property
+    def downloaded(self):
+        # Each segment thread only ever writes its own counter, so no lock on the hot path.
+        return self.base + sum(self.counters.values())
+
+    def run(self):
+        self.started = time.time()
+        if self.size and not os.path.exists(self.part) and os.path.exists(self.dest) \
+                and os.path.getsize(self.dest) == self.size:
+            self.log.info(f"✅ Already downloaded: {self.name}")
+            return self.size
+        if self.reporter:
+            self.reporter.add(self)
+        try:
+            try:
+                self._transfer()
+            finally:
+                if self.reporter:
+                    self.reporter.remove(self)
+            if self.verifier:
+                self._verify()
+            self._publish()
+        except Exception:
+            DOWNLOADS.labels('failed').inc()
+            raise
+        DOWNLOADS.labels('done').inc()
+        return self.downloaded
+
+    def _transfer(self):
+        for attempt in range(self.retries + 1):
+            try:
+                if self.size and self.supports_range():
+                    self._segmented()
+                else:
+                    self._single()
+                break
+            except Exception as e:
+                if attempt == self.retries or getattr(e, 'errno', None) == errno.ENOSPC:
+                    raise
+                self.log.warning(f"⚠️ {self.name} interrupted ({e}) — resuming")
+                time.sleep(min(2 ** attempt, 30))
+                if self.refresh:
+                    self.url = self.refresh() or self.url
+
+    def _verify(self):
+        for attempt in range(self.retries + 1):
+            bad = self.verifier.finish(self.part)
+            if not bad:
+                edge = self.verifier.edge_bytes()
+                self.log.info(f"🔒 Verified {self.verifier.count()} piece(s): {self.name}"
+                              + (f" ({edge / MB:.2f} MB shared with neighbouring files still to check)" if edge else ""))
+                return
+            ranges = self.verifier.ranges(bad)
+            self.log.warning(f"⚠️ {self.name}: {len(bad)} piece(s) failed hash check "
+                             f"({sum(end - start for start, end in ranges) / MB:.1f} MB)")
+            if attempt == self.retries:
+                break
+            self.verifier.forget(bad)
+            with self.lock:
+                self.done = subtract_ranges(self.done, ranges)
+            self._save_journal()
+            self._transfer()
+        raise IOError(f"{len(bad)} piece(s) of {self.name} failed verification")
+
+    def connection(self):
+        return self.transfers.connection(self.url) if self.transfers else nullcontext()
+
+    def supports_range(self):
+        try:
+            with self.connection(), session().get(self.url, headers={'Range': 'bytes=0-0'}, stream=True, timeout=DOWNLOAD_TIMEOUT) as r:
+                return r.status_code == 206 and r.headers.get('Content-Range', '').endswith(f"/{self.size}")
+        except Exception as e:
+            self.log.debug(f"Range probe failed for {self.url}: {e}")
+            return False
+
+    def _load_journal(self):
+        try:
+            with open(self.journal, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if state.get("size") == self.size and os.path.getsize(self.part) == self.size:
+                return merge_ranges(state.get("done", []))
+        except (OSError, ValueError):
+            pass
+        return None
+
+    def _save_journal(self, fd=None):
+        if fd is not None:
+            os.fsync(fd)
+        with self.lock:
+            state = {"size": self.size, "done": self.done}
+            tmp = self.journal + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+            os.replace(tmp, self.journal)
+
+    def _mark(self, start, end):
+        if end > start:
+            with self.lock:
+                self.done = merge_ranges(self.done + [[start, end]])
+
+    def _segmented(self):
+        done = self._load_journal()
+        fd = os.open(self.part, OPEN_FLAGS)
+        try:
+            if done is None:
+                os.ftruncate(fd, 0)
+                preallocate(fd, self.size)
+                done = []
+            with self.lock:
+                self.done = done
+                self.counters = {}
+                self.base = sum(end - start for start, end in done)
+                if self.resumed == 0 and self.base:
+                    self.resumed = self.base
+                    self.log.info(f"↪️ Resuming {self.name} at {self.base / MB:.1f}/{self.size / MB:.1f} MB")
+            ranges = []
+            for start, end in missing_ranges(done, self.size):
+                ranges += split_ranges(end, self.segments, self.min_segment, start)
+            self.counters = {start: 0 for start, _ in ranges}
+            errors = []
+            threads = [threading.Thread(target=self._fetch_range, args=(fd, start, end, errors)) for start, end in ranges]
+            [t.start() for t in threads]
+            [t.join() for t in threads]
+            self._save_journal(fd)
+        finally:
+            os.close(fd)
+        if errors:
+            raise errors[0]
+        if missing_ranges(self.done, self.size):
+            raise IOError("ranges still missing after transfer")
+
+    def _fetch_range(self, fd, start, end, errors):
+        committed = offset = start
+        buf = memoryview(bytearray(self.chunk_size))
+        feed = self.verifier.stream(start).feed if self.verifier else None
+        throttle = self.transfers.throttle if self.transfers else None
+        try:
+            headers = {'Range': f"bytes={start}-{end - 1}", 'Accept-Encoding': 'identity'}
+            with self.connection(), session().get(self.url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as r:
+                if r.status_code != 206:
+                    raise IOError(f"range {start}-{end - 1} answered {r.status_code}")
+                readinto = r.raw.readinto
+                while offset < end:
+                    n = readinto(buf[:min(self.chunk_size, end - offset)])
+                    if not n:
+                        break
+                    pwrite(fd, buf[:n], offset, self.write_lock)
+                    if feed:
+                        feed(buf[:n])
+                    if throttle:
+                        throttle(n)
+                    DOWNLOAD_BYTES.inc(n)
+                    offset += n
+                    self.counters[start] = offset - start
+                    if offset - committed >= self.checkpoint:
+                        self._mark(committed, offset)
+                        self._save_journal(fd)
+                        committed = offset
+            if offset != end:
+                raise IOError(f"range {start}-{end - 1} short by {end - offset} bytes")
+        except Exception as e:
+            errors.append(e)
+        finally:
+            self._mark(committed, offset)
+
+    def _single(self):
+        # No Range support: nothing to resume from, start the .part over.
+        self.base, self.counters = 0, {0: 0}
+        buf = memoryview(bytearray(self.chunk_size))
+        feed = self.verifier.stream(0).feed if self.verifier else None
+        throttle = self.transfers.throttle if self.transfers else None
+        received = 0
+        with self.connection(), session().get(self.url, stream=True, timeout=DOWNLOAD_TIMEOUT,
+                                              headers={'Accept-Encoding': 'identity'}) as r:
+            r.raise_for_status()
+            readinto = r.raw.readinto
+            with open(self.part, 'wb', buffering=0) as f:
+                if self.size:
+                    preallocate(f.fileno(), self.size)
+                while True:
+                    n = readinto(buf)
+                    if not n:
+                        break
+                    f.write(buf[:n])
+                    if feed:
+                        feed(buf[:n])
+                    if throttle:
+                        throttle(n)
+                    DOWNLOAD_BYTES.inc(n)
+                    received += n
+                    self.counters[0] = received
+                if received < self.size:
+                    # The preallocated tail must not pass for downloaded bytes.
+                    f.truncate(received)
+        if self.size and received != self.size:
+            raise IOError(f"expected {self.size} bytes, got {received}")
+
+    def _publish(self):
+        actual = os.path.getsize(self.part)
+        if self.size and actual != self.size:
+            raise IOError(f"{self.part} is {actual} bytes, expected {self.size}")
+        os.replace(self.part, self.dest)
+        if os.path.exists(self.journal):
+            os.remove(self.journal)
+
+
+class ProgressReporter:
+    # One thread samples every active Download at a fixed rate and emits a single
+    # aggregated status line, instead of each transfer reporting per chunk.
+    def __init__(self, emit, interval=1.0):
+        self.emit = emit
+        self.interval = max(0.1, float(interval))
+        self.lock = threading.Lock()
+        self.active = {}
+
+    def start(self):
+        threading.Thread(target=self._run, name="progress-reporter", daemon=True).start()
+        return self
+
+    def add(self, download):
+        with self.lock:
+            self.active[download] = download.downloaded
+
+    def remove(self, download):
+        with self.lock:
+            self.active.pop(download, None)
+
+    def _run(self):
+        last = time.monotonic()
+        while True:
+            time.sleep(self.interval)
+            now = time.monotonic()
+            elapsed, last = max(now - last, 1e-3), now
+            with self.lock:
+                items = list(self.active.items())
+            if not items:
+                continue
+            total, parts = 0.0, []
+            for d, previous in items:
+                current = d.downloaded
+                rate = (current - previous) / elapsed
+                total += rate
+                with self.lock:
+                    if d in self.active:
+                        self.active[d] = current
+                if d.size:
+                    eta = (d.size - current) / rate if rate > 0 else 0
+                    parts.append(f"{d.name} {current * 100 / d.size:.1f}% at {rate / MB:.2f} MB/s ETA {eta:.0f}s")
+                else:
+                    parts.append(f"{d.name} {current / MB:.1f} MB at {rate / MB:.2f} MB/s")
+            self.emit(f"⬇️ {len(items)} active | {total / MB:.2f} MB/s | " + " | ".join(parts))
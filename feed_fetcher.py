@@ -0,0 +1,151 @@
+import os, re, json, time, codecs, threading, logging
+from html import unescape
+from concurrent.futures import ThreadPoolExecutor
+from alldebrid_client import API_TIMEOUT, DOWNLOAD_TIMEOUT, session
+
+ANCHOR_RE = re.compile(r"""<a\b[^>]*?\bhref\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))[^>]*>(.*?)</a\s*>""",
+                       re.IGNORECASE | re.DOTALL)
+OPEN_RE = re.compile(r"<a\b", re.IGNORECASE)
+TAG_RE = re.compile(r"<[^>]*>")
+
+
+def iter_anchors(chunks):
+    # Yields (href, text) for each <a href> in a stream of HTML text chunks. Only the
+    # unfinished tail of the page is kept between chunks; no document tree is built.
+    buf = ''
+    for chunk in chunks:
+        buf += chunk
+        end = 0
+        for m in ANCHOR_RE.finditer(buf):
+            href = m.group(1) if m.group(1) is not None else m.group(2) if m.group(2) is not None else m.group(3)
+            yield unescape(href), unescape(TAG_RE.sub('', m.group(4)))
+            end = m.end()
+        m = OPEN_RE.search(buf, end)
+        buf = buf[m.start():] if m else buf[-1:]
+
+
+class FeedFetcher:
+    # Polls a remote index page for new .torrent links. The page is requested with
+    # If-None-Match/If-Modified-Since, so an unchanged feed costs one 304; links are
+    # pulled out with iter_anchors() while the body streams in. New torrents download
+    # concurrently into `folder` and go straight to on_torrent(path). Fetched names, the
+    # validators and links still to retry are kept in `state_path`, so restarts neither
+    # re-download anything nor lose a torrent that failed before the feed went 304.
+    def __init__(self, url, folder, select, on_torrent=None, auth=None, state_path='feed_state.json',
+                 log=None, workers=4, retries=3, known=()):
+        self.url = url
+        self.folder = folder
+        self.select = select
+        self.on_torrent = on_torrent
+        self.auth = auth
+        self.state_path = state_path
+        self.log = log or logging.getLogger(__name__)
+        self.workers = max(1, int(workers))
+        self.retries = max(1, int(retries))
+        self.known = tuple(known)
+        self.lock = threading.Lock()
+        self.etag = None
+        self.modified = None
+        self.seen = set()
+        self.failed = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.state_path, encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.etag = state.get('etag')
+        self.modified = state.get('modified')
+        self.seen = set(state.get('seen', []))
+        self.failed = dict(state.get('failed', {}))
+
+    def save(self):
+        with self.lock:
+            state = {'etag': self.etag, 'modified': self.modified, 'seen': sorted(self.seen),
+                     'failed': dict(self.failed)}
+        tmp = self.state_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp, self.state_path)
+
+    def is_new(self, name):
+        with self.lock:
+            if name in self.seen:
+                return False
+            # Torrents fetched before the state file existed are still lying in these folders.
+            if any(os.path.exists(os.path.join(folder, name)) for folder in (self.folder,) + self.known):
+                self.seen.add(name)
+                return False
+            return True
+
+    def links(self):
+        # {name: url} of new torrents on the page, or {} when it hasn't changed.
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.modified:
+            headers['If-Modified-Since'] = self.modified
+        with session().get(self.url, auth=self.auth, headers=headers, stream=True, timeout=API_TIMEOUT) as r:
+            if r.status_code == 304:
+                return {}
+            r.raise_for_status()
+            decoder = codecs.getincrementaldecoder(r.encoding or 'utf-8')(errors='replace')
+            found = {}
+            for href, text in iter_anchors(decoder.decode(chunk) for chunk in r.iter_content(65536)):
+                name = self.select(text)
+                if name and name not in found and self.is_new(name):
+                    found[name] = f"{self.url.rstrip('/')}/{href.lstrip('/')}"
+            validators = (r.headers.get('ETag'), r.headers.get('Last-Modified'))
+        with self.lock:
+            self.etag, self.modified = validators
+        return found
+
+    def poll(self):
+        # One round: list the feed, then fetch new and previously failed torrents.
+        found = self.links()
+        with self.lock:
+            pending = dict(self.failed)
+            self.failed.clear()
+        pending.update(found)
+        if pending:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(pending)), thread_name_prefix="feed") as pool:
+                list(pool.map(lambda item: self.fetch(*item), pending.items()))
+        self.save()
+        return len(pending)
+
+    def fetch(self, name, link):
+        path = os.path.join(self.folder, name)
+        tmp = path + '.part'
+        for attempt in range(self.retries):
+            try:
+                with session().get(link, auth=self.auth, stream=True, timeout=DOWNLOAD_TIMEOUT) as r:
+                    r.raise_for_status()
+                    with open(tmp, 'wb') as f:
+                        for chunk in r.iter_content(65536):
+                            f.write(chunk)
+                os.replace(tmp, path)
+                break
+            except Exception as e:
+                self.log.warning(f"⚠️ Fetching {name} failed ({attempt + 1}/{self.retries}): {e}")
+                if attempt + 1 < self.retries:
+                    time.sleep(min(30, 2 ** attempt))
+        else:
+            with self.lock:
+                self.failed[name] = link
+            return False
+        with self.lock:
+            self.seen.add(name)
+        self.log.info(f"✅ Downloaded remote torrent: {name}")
+        if self.on_torrent:
+            self.on_torrent(path)
+        return True
+
+    def run(self, interval=30):
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                self.log.error(f"⚠️ Remote fetch error: {e}")
+            time.sleep(interval)
@@ -0,0 +1,64 @@
+import re
+
+MB = 1024 * 1024
+ROM_EXTENSIONS = ('.nsp', '.nsz', '.xci', '.xcz')
+
+
+class FileRules:
+    # Decides from a magnet link's filename and size alone whether the file is worth
+    # unlocking, so NFOs, samples, archives and versions already in the library never
+    # cost an unlock call or a byte of transfer. check() returns None for a wanted file
+    # or the reason it was skipped.
+    def __init__(self, extensions=ROM_EXTENSIONS, include=None, exclude=None, min_size=0, max_size=0,
+                 library=None):
+        self.extensions = tuple(e.lower() for e in extensions) if extensions else None
+        self.include = re.compile(include) if include else None
+        self.exclude = re.compile(exclude) if exclude else None
+        self.min_size = min_size
+        self.max_size = max_size
+        self.library = library
+
+    @classmethod
+    def from_config(cls, config, library=None):
+        extensions = [e.strip() for e in config.get('RULES', 'extensions', fallback=','.join(ROM_EXTENSIONS)).split(',')]
+        return cls([e for e in extensions if e],
+                   config.get('RULES', 'include', fallback='') or None,
+                   config.get('RULES', 'exclude', fallback='') or None,
+                   int(config.getfloat('RULES', 'min_size_mb', fallback=0) * MB),
+                   int(config.getfloat('RULES', 'max_size_mb', fallback=0) * MB),
+                   library if config.getboolean('RULES', 'skip_owned', fallback=True) else None)
+
+    def keeps(self, name):
+        # Whether a file of this type belongs in the library once downloaded.
+        return not self.extensions or (name or '').lower().endswith(self.extensions)
+
+    def check(self, name, size=0):
+        name = name or ''
+        if not self.keeps(name):
+            return "extension"
+        if self.exclude and self.exclude.search(name):
+            return "excluded"
+        if self.include and not self.include.search(name):
+            return "not included"
+        if size and self.min_size and size < self.min_size:
+            return "too small"
+        if size and self.max_size and size > self.max_size:
+            return "too large"
+        if self.library:
+            match, _ = self.library.lookup(name)
+            if match == "same":
+                return "in library"
+            if match == "newer":
+                return "newer in library"
+        return None
+
+    def select(self, links):
+        # Splits magnet links into (wanted, [(link, reason), ...]).
+        wanted, skipped = [], []
+        for link in links:
+            reason = self.check(link.get("filename"), link.get("size") or 0)
+            if reason:
+                skipped.append((link, reason))
+            else:
+                wanted.append(link)
+        return wanted, skipped
@@ -0,0 +1,77 @@
+import json, time, sqlite3, threading, logging
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    info_hash TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    stage TEXT,
+    state TEXT NOT NULL DEFAULT 'active',
+    magnet_id TEXT,
+    links TEXT NOT NULL DEFAULT '[]',
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state);
+CREATE TABLE IF NOT EXISTS files (
+    info_hash TEXT NOT NULL,
+    link TEXT NOT NULL,
+    name TEXT,
+    size INTEGER,
+    outcome TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (info_hash, link)
+);
+"""
+
+
+class JobStore:
+    # Durable record of the torrent pipeline, keyed by info-hash: the stage each job
+    # has reached, its magnet ID and links, and the outcome of every file. The
+    # scheduler saves a job before each stage runs, so after a restart in_flight()
+    # lists exactly the jobs that were interrupted and where.
+    def __init__(self, path='jobs.db', log=None):
+        self.path = path
+        self.log = log or logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.lock, self.db:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.executescript(SCHEMA)
+
+    def _execute(self, sql, args=()):
+        with self.lock, self.db:
+            return self.db.execute(sql, args).fetchall()
+
+    def save(self, job, state='active'):
+        if not job.info_hash:
+            return
+        self._execute(
+            "INSERT INTO jobs (info_hash, path, name, stage, state, magnet_id, links, updated) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (info_hash) DO UPDATE SET "
+            "path = excluded.path, name = excluded.name, stage = excluded.stage, state = excluded.state, "
+            "magnet_id = excluded.magnet_id, links = excluded.links, updated = excluded.updated",
+            (job.info_hash, job.path, job.name, job.stage, state,
+             str(job.magnet_id) if job.magnet_id is not None else None, json.dumps(job.links), time.time()))
+
+    def finish(self, job, state):
+        # state is 'done' or 'failed'; a done job's per-file rows are no longer needed.
+        self.save(job, state)
+        if state == 'done' and job.info_hash:
+            self._execute("DELETE FROM files WHERE info_hash = ?", (job.info_hash,))
+
+    def file_outcome(self, job, link, name, size, outcome):
+        if not job.info_hash:
+            return
+        self._execute(
+            "INSERT OR REPLACE INTO files (info_hash, link, name, size, outcome, updated) VALUES (?, ?, ?, ?, ?, ?)",
+            (job.info_hash, link, name, size, outcome, time.time()))
+
+    def outcomes(self, info_hash):
+        rows = self._execute("SELECT link, outcome FROM files WHERE info_hash = ?", (info_hash,))
+        return {row["link"]: row["outcome"] for row in rows}
+
+    def in_flight(self):
+        rows = self._execute("SELECT * FROM jobs WHERE state = 'active' ORDER BY updated")
+        return [dict(row, links=json.loads(row["links"])) for row in rows]
@@ -0,0 +1,91 @@
+import os, re, time, threading, logging
+from watcher import observe
+
+TAG_RE = re.compile(r"\[([0-9A-F]{16})\]\[v(\d+)\]", re.IGNORECASE)
+
+
+def parse_tag(text):
+    match = TAG_RE.search(text or '')
+    if match:
+        return match.group(1).upper(), int(match.group(2))
+    return None
+
+
+class LibraryIndex:
+    # In-memory map of title ID -> {version: filename} for everything in the library,
+    # built with one directory scan and kept current by add()/remove() and, when
+    # watchdog is available, filesystem events.
+    def __init__(self, folder, log=None):
+        self.folder = folder
+        self.log = log or logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.titles = {}
+        self.observer = None
+
+    def build(self):
+        titles = {}
+        count = 0
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                parsed = parse_tag(entry.name)
+                if parsed and entry.is_file():
+                    titles.setdefault(parsed[0], {})[parsed[1]] = entry.name
+                    count += 1
+        with self.lock:
+            self.titles = titles
+        self.log.info(f"📚 Library index: {count} tagged file(s), {len(titles)} title(s)")
+        return self
+
+    def add(self, filename):
+        parsed = parse_tag(os.path.basename(filename))
+        if parsed:
+            with self.lock:
+                self.titles.setdefault(parsed[0], {})[parsed[1]] = os.path.basename(filename)
+
+    def remove(self, filename):
+        name = os.path.basename(filename)
+        parsed = parse_tag(name)
+        if parsed:
+            with self.lock:
+                versions = self.titles.get(parsed[0], {})
+                if versions.get(parsed[1]) == name:
+                    del versions[parsed[1]]
+                    if not versions:
+                        del self.titles[parsed[0]]
+
+    def versions(self, title_id):
+        with self.lock:
+            return dict(self.titles.get(title_id.upper(), {}))
+
+    def lookup(self, tag):
+        # Returns ("same", file), ("newer", file) or (None, None) for a "[TITLEID][vN]" tag.
+        parsed = parse_tag(tag)
+        if not parsed:
+            return None, None
+        title_id, version = parsed
+        with self.lock:
+            versions = self.titles.get(title_id)
+            if not versions:
+                return None, None
+            if version in versions:
+                return "same", versions[version]
+            # v0 is a base game; an update sharing its ID does not replace it.
+            latest = max(versions)
+            if version and latest > version:
+                return "newer", versions[latest]
+        return None, None
+
+    def watch(self, rescan_interval=300):
+        # Follow changes made to the library behind our back (manual copies, deletes).
+        self.observer = observe(self.folder, self.add, self.remove, self.log)
+        if not self.observer:
+            threading.Thread(target=self._rescan, args=(rescan_interval,), name="library-rescan", daemon=True).start()
+        return self
+
+    def _rescan(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.build()
+            except OSError as e:
+                self.log.warning(f"⚠️ Library rescan failed: {e}")
@@ -0,0 +1,177 @@
+import time, threading, logging
+import metrics
+
+MAGNET_WAIT = metrics.histogram('alldebrid_magnet_wait_seconds', "Time from upload until a magnet is Ready")
+MAGNETS_UPLOADED = metrics.counter('alldebrid_magnets_uploaded_total', "Magnets sent to /magnet/upload by result",
+                                   ('result',))
+
+
+class MagnetPoller:
+    # One thread polls the status of every in-flight magnet with a single
+    # /magnet/status call and hands Ready links back through on_ready(job, links).
+    # The poll interval adapts to the shortest ETA AllDebrid reports, and backs off
+    # while magnets are only queued.
+    def __init__(self, fetch, on_ready, on_error, log=None,
+                 min_interval=2, max_interval=60, timeout=1800):
+        self.fetch = fetch
+        self.on_ready = on_ready
+        self.on_error = on_error
+        self.log = log or logging.getLogger(__name__)
+        self.min_interval = max(0.5, float(min_interval))
+        self.max_interval = max(self.min_interval, float(max_interval))
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.watched = {}
+        self.interval = self.min_interval
+
+    def start(self):
+        threading.Thread(target=self._run, name="magnet-poller", daemon=True).start()
+        return self
+
+    def watch(self, job):
+        # Cached magnets come back from /magnet/upload with ready=True; poll those
+        # straight away instead of waiting for the next tick.
+        with self.lock:
+            self.watched[str(job.magnet_id)] = {"job": job, "since": time.time(), "status": None}
+            self.interval = self.min_interval
+            first = len(self.watched) == 1
+        if first or getattr(job, "ready", False):
+            self.wake.set()
+
+    def active(self):
+        with self.lock:
+            return len(self.watched)
+
+    def _run(self):
+        while True:
+            with self.lock:
+                idle = not self.watched
+            if idle:
+                self.wake.wait()
+                self.wake.clear()
+            try:
+                self.poll()
+            except Exception as e:
+                self.log.error(f"Poll error: {e}")
+                self.interval = min(self.interval * 2, self.max_interval)
+            self.wake.wait(self.interval)
+            self.wake.clear()
+
+    def poll(self):
+        magnets = {str(m.get("id")): m for m in self.fetch()}
+        etas = []
+        queued = False
+        now = time.time()
+        with self.lock:
+            watched = list(self.watched.items())
+        for mid, entry in watched:
+            job = entry["job"]
+            magnet = magnets.get(mid)
+            if magnet is None:
+                self._drop(mid)
+                self.on_error(job, f"magnet {mid} not found on account")
+                continue
+            status = magnet.get("status")
+            code = magnet.get("statusCode", 0)
+            if status == "Ready" or code == 4:
+                self._drop(mid)
+                MAGNET_WAIT.observe(now - entry["since"])
+                self.log.info(f"✅ Download is ready: {job.name}")
+                self.on_ready(job, magnet.get("links", []))
+                continue
+            if code >= 5:
+                self._drop(mid)
+                self.on_error(job, f"magnet {mid} status {status}")
+                continue
+            if now - entry["since"] > self.timeout:
+                self._drop(mid)
+                self.on_error(job, f"magnet {mid} not ready after {self.timeout}s")
+                continue
+            if status != entry["status"]:
+                entry["status"] = status
+                self.log.info(f"⏳ Status: {status} | {job.name}")
+            size = magnet.get("size") or 0
+            done = magnet.get("downloaded") or 0
+            speed = magnet.get("downloadSpeed") or 0
+            if speed > 0 and size > done:
+                etas.append((size - done) / speed)
+            else:
+                queued = True
+        self.interval = self._next_interval(etas, queued)
+
+    def _next_interval(self, etas, queued):
+        if etas:
+            # Check back at half the shortest ETA so a finishing magnet is picked up promptly.
+            return min(max(min(etas) / 2, self.min_interval), self.max_interval)
+        if queued:
+            return min(self.interval * 1.5, self.max_interval)
+        return self.min_interval
+
+    def _drop(self, mid):
+        with self.lock:
+            self.watched.pop(mid, None)
+
+
+class MagnetUploader:
+    # Collects jobs reaching the upload stage within `window` seconds and sends them
+    # to /magnet/upload as one magnets[] array. Each returned entry is matched back to
+    # its job by magnet URI (falling back to position), so one rejected magnet only
+    # fails its own job.
+    def __init__(self, upload, on_uploaded, on_error, log=None, window=2, batch_size=20):
+        self.upload = upload
+        self.on_uploaded = on_uploaded
+        self.on_error = on_error
+        self.log = log or logging.getLogger(__name__)
+        self.window = max(0.0, float(window))
+        self.batch_size = max(1, int(batch_size))
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.pending = []
+
+    def start(self):
+        threading.Thread(target=self._run, name="magnet-uploader", daemon=True).start()
+        return self
+
+    def add(self, job):
+        with self.lock:
+            self.pending.append(job)
+        self.wake.set()
+
+    def _run(self):
+        while True:
+            self.wake.wait()
+            time.sleep(self.window)
+            with self.lock:
+                batch = self.pending[:self.batch_size]
+                del self.pending[:self.batch_size]
+                if not self.pending:
+                    self.wake.clear()
+            if batch:
+                self.send(batch)
+
+    def send(self, batch):
+        try:
+            results = self.upload([job.magnet for job in batch])
+        except Exception as e:
+            MAGNETS_UPLOADED.labels('error').inc(len(batch))
+            for job in batch:
+                self.on_error(job, f"magnet upload failed: {e}")
+            return
+        self.log.info(f"📤 Uploaded {len(batch)} magnet(s) in one request")
+        by_uri = {}
+        for i, entry in enumerate(results):
+            by_uri.setdefault(entry.get("magnet"), []).append(i)
+        for i, job in enumerate(batch):
+            matches = by_uri.get(job.magnet)
+            index = matches.pop(0) if matches else i
+            entry = results[index] if index < len(results) else None
+            if not entry:
+                MAGNETS_UPLOADED.labels('missing').inc()
+                self.on_error(job, "magnet missing from upload response")
+            elif "error" in entry or "id" not in entry:
+                MAGNETS_UPLOADED.labels('rejected').inc()
+                self.on_error(job, f"magnet rejected: {entry.get('error', entry)}")
+            else:
+                MAGNETS_UPLOADED.labels('accepted').inc()
+                self.on_uploaded(job, entry)
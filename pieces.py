@@ -0,0 +1,177 @@
+import os, hashlib, threading
+
+READ_SIZE = 1024 * 1024
+
+
+def match_file(meta, name, size):
+    # The torrent entry an unlocked file corresponds to, by name and size, or None.
+    if not meta:
+        return None
+    matches = [f for f in meta.files if os.path.basename(f.path) == name and f.length == size]
+    if not matches:
+        matches = [f for f in meta.files if f.length == size]
+    return matches[0] if len(matches) == 1 else None
+
+
+def check_shared_pieces(meta, locate):
+    # Hashes the pieces of a multi-file torrent that straddle file boundaries, which no
+    # single PieceVerifier can check. locate(torrent_file) gives the path of a finished
+    # file, or None if it isn't on disk. Returns (bad, unchecked): the paths (as in
+    # meta.files) of files in a piece that failed, and {path: bytes} of shared pieces
+    # that could not be checked because a neighbour is missing.
+    bad, unchecked = set(), {}
+    if not meta or not meta.piece_length or not meta.pieces:
+        return bad, unchecked
+    files = [f for f in meta.files if f.length]
+    pl = meta.piece_length
+    shared = sorted({i for f in files for i in (f.offset // pl, (f.offset + f.length - 1) // pl)})
+    buf = memoryview(bytearray(READ_SIZE))
+    for index in shared:
+        start, end = index * pl, min((index + 1) * pl, meta.total_size)
+        members = [f for f in files if f.offset < end and f.offset + f.length > start]
+        if len(members) < 2:
+            continue
+        paths = [locate(f) for f in members]
+        if None in paths:
+            for f in members:
+                overlap = min(end, f.offset + f.length) - max(start, f.offset)
+                unchecked[f.path] = unchecked.get(f.path, 0) + overlap
+            continue
+        h = hashlib.sha1()
+        for f, path in zip(members, paths):
+            with open(path, 'rb', buffering=0) as fh:
+                fh.seek(max(start, f.offset) - f.offset)
+                left = min(end, f.offset + f.length) - max(start, f.offset)
+                while left:
+                    n = fh.readinto(buf[:min(READ_SIZE, left)])
+                    if not n:
+                        break
+                    h.update(buf[:n])
+                    left -= n
+        if h.digest() != meta.pieces[index * 20:index * 20 + 20]:
+            bad.update(f.path for f in members)
+    return bad, unchecked
+
+
+class PieceVerifier:
+    # Checks one downloaded file against the torrent's SHA-1 piece table. Offsets are
+    # local to the file; `offset` is where the file starts inside the torrent, so pieces
+    # of multi-file torrents map correctly. Only pieces lying wholly inside the file can
+    # be checked here; the (at most two) pieces shared with neighbouring files are left
+    # to check_shared_pieces() once the neighbours are on disk.
+    def __init__(self, pieces, piece_length, total_size, offset, length):
+        self.pieces = pieces
+        self.piece_length = piece_length
+        self.total_size = total_size
+        self.offset = offset
+        self.length = length
+        self.first = -(-offset // piece_length)
+        last_end = offset + length
+        self.last = (len(pieces) // 20 - 1) if last_end == total_size else (last_end // piece_length - 1)
+        self.lock = threading.Lock()
+        self.good = set()
+        self.bad = set()
+
+    @classmethod
+    def for_file(cls, meta, name, size):
+        # None when the torrent has no piece table or no single file matches; the caller warns.
+        if not meta or not meta.piece_length or not meta.pieces:
+            return None
+        f = match_file(meta, name, size)
+        if f is None:
+            return None
+        return cls(meta.pieces, meta.piece_length, meta.total_size, f.offset, f.length)
+
+    def count(self):
+        return max(0, self.last - self.first + 1)
+
+    def edge_bytes(self):
+        # Bytes at the file's ends that lie in pieces shared with other files.
+        if not self.count():
+            return self.length
+        return self.length - (self.span(self.last)[1] - self.span(self.first)[0])
+
+    def span(self, index):
+        # Local [start, end) of piece `index`.
+        start = index * self.piece_length - self.offset
+        end = min((index + 1) * self.piece_length, self.total_size) - self.offset
+        return start, end
+
+    def piece_at(self, pos):
+        return (pos + self.offset) // self.piece_length
+
+    def verifiable(self, index):
+        return self.first <= index <= self.last
+
+    def record(self, index, digest):
+        ok = digest == self.pieces[index * 20:index * 20 + 20]
+        with self.lock:
+            (self.good if ok else self.bad).add(index)
+            (self.bad if ok else self.good).discard(index)
+        return ok
+
+    def stream(self, start):
+        return PieceStream(self, start)
+
+    def forget(self, indices):
+        with self.lock:
+            for index in indices:
+                self.good.discard(index)
+                self.bad.discard(index)
+
+    def finish(self, path):
+        # Hash from disk only the pieces no stream saw from start to end (segment
+        # boundaries, data resumed from a previous run), then return bad pieces.
+        with self.lock:
+            unchecked = [i for i in range(self.first, self.last + 1) if i not in self.good and i not in self.bad]
+        if unchecked:
+            buf = memoryview(bytearray(READ_SIZE))
+            with open(path, 'rb', buffering=0) as f:
+                for index in unchecked:
+                    start, end = self.span(index)
+                    f.seek(start)
+                    h = hashlib.sha1()
+                    left = end - start
+                    while left:
+                        n = f.readinto(buf[:min(READ_SIZE, left)])
+                        if not n:
+                            break
+                        h.update(buf[:n])
+                        left -= n
+                    self.record(index, h.digest())
+        with self.lock:
+            return sorted(self.bad)
+
+    def ranges(self, indices):
+        return [self.span(i) for i in indices]
+
+
+class PieceStream:
+    # Hashes the bytes of one sequential stream (a download segment) as they arrive.
+    def __init__(self, verifier, start):
+        self.v = verifier
+        self.pos = start
+        self.index = None
+        self.end = 0
+        self.hasher = None
+
+    def feed(self, data):
+        v = self.v
+        off, n = 0, len(data)
+        while off < n:
+            pos = self.pos + off
+            if self.hasher is None:
+                index = v.piece_at(pos)
+                start, end = v.span(index)
+                if start != pos or not v.verifiable(index):
+                    # Mid-piece or unverifiable: skip ahead to the next piece boundary.
+                    off += min(n - off, v.span(index + 1)[0] - pos)
+                    continue
+                self.index, self.end, self.hasher = index, end, hashlib.sha1()
+            take = min(n - off, self.end - pos)
+            self.hasher.update(data[off:off + take])
+            off += take
+            if pos + take == self.end:
+                v.record(self.index, self.hasher.digest())
+                self.hasher = None
+        self.pos += n
@@ -0,0 +1,353 @@
+import os, time, shutil, threading, functools, configparser, logging
+from scheduler import Job, JobScheduler, JobFailed, DONE, WAIT
+from magnets import MagnetPoller, MagnetUploader
+from job_store import JobStore
+from downloader import Download
+from pieces import PieceVerifier, match_file, check_shared_pieces
+from disk_space import SpaceReserver
+from library_index import parse_tag
+from alldebrid_client import AllDebridError
+import torrent_meta
+
+
+def pipeline_settings(config):
+    # The values TorrentPipeline reads from config.ini.
+    return {
+        'threads': config.getint('SETTINGS', 'threads', fallback=4),
+        'jobs_db': config.get('SETTINGS', 'jobs_db', fallback='jobs.db'),
+        'poll_interval': config.getfloat('POLL', 'interval', fallback=5),
+        'poll_max_interval': config.getfloat('POLL', 'max_interval', fallback=60),
+        'poll_timeout': config.getfloat('POLL', 'timeout', fallback=1800),
+        'upload_window': config.getfloat('UPLOAD', 'batch_window', fallback=2),
+        'upload_batch_size': config.getint('UPLOAD', 'batch_size', fallback=20),
+        'segments': config.getint('DOWNLOAD', 'segments', fallback=4),
+        'min_segment': config.getint('DOWNLOAD', 'min_segment_mb', fallback=16) * 1024 * 1024,
+        'retries': config.getint('DOWNLOAD', 'retries', fallback=3),
+        'chunk_size': config.getint('DOWNLOAD', 'chunk_kb', fallback=1024) * 1024,
+        'verify': config.getboolean('DOWNLOAD', 'verify', fallback=True),
+        'min_free_space': int(config.getfloat('DISK', 'min_free_gb', fallback=1) * 1024 * 1024 * 1024),
+        'space_interval': config.getfloat('DISK', 'check_interval', fallback=30),
+    }
+
+
+def read_bandwidth(path='config.ini'):
+    # [TRANSFERS] bandwidth_mb is re-read while running; 0 means no cap.
+    cfg = configparser.ConfigParser()
+    cfg.read(path)
+    return int(cfg.getfloat('TRANSFERS', 'bandwidth_mb', fallback=0) * 1024 * 1024)
+
+
+def transfer_priority(unlocked):
+    # Updates and DLC go ahead of v0 base games; smaller files first within each group.
+    parsed = parse_tag(unlocked["name"])
+    base_game = parsed is not None and parsed[1] == 0 and parsed[0].endswith('000')
+    return (1 if base_game else 0, unlocked["size"] or 0)
+
+
+class TorrentPipeline:
+    # The torrent pipeline shared by alldebrid.py and alldebrid_download.py: torrents go
+    # parse -> dedupe -> upload -> wait-ready -> unlock -> reserve -> download -> publish
+    # -> finalize on a JobScheduler, with magnets uploaded and polled in batches, disk
+    # space reserved before any file is written and files fetched through the shared
+    # TransferScheduler.
+    # `settings` comes from pipeline_settings(); the scheduler and its helpers are built
+    # by start(). `on_published(path)` is called for every ROM that reaches the library,
+    # `end_line()` before logging a finished file.
+    def __init__(self, client, library, rules, publisher, transfers, reporter, complete_folder, settings,
+                 log=None, on_published=None, end_line=None):
+        self.client = client
+        self.library = library
+        self.rules = rules
+        self.publisher = publisher
+        self.transfers = transfers
+        self.reporter = reporter
+        self.complete_folder = complete_folder
+        self.settings = settings
+        self.log = log or logging.getLogger(__name__)
+        self.on_published = on_published
+        self.end_line = end_line or (lambda: None)
+        self.scheduler = None
+        self.poller = None
+        self.uploader = None
+        self.store = None
+        self.space = None
+        self.stages = [
+            ("parse", self.stage_parse),
+            ("dedupe", self.stage_dedupe),
+            ("upload", self.stage_upload),
+            ("wait-ready", self.stage_wait_ready),
+            ("unlock", self.stage_unlock),
+            ("reserve", self.stage_reserve),
+            ("download", self.stage_download),
+            ("publish", self.stage_publish),
+            ("finalize", self.stage_finalize),
+        ]
+
+    def start(self):
+        s = self.settings
+        self.library.build().watch()
+        self.store = JobStore(s['jobs_db'], self.log)
+        self.scheduler = JobScheduler(self.stages, s['threads'], self.log, store=self.store).start()
+        self.poller = MagnetPoller(self.client.magnet_status, self.on_magnet_ready, self.scheduler.fail, self.log,
+                                   s['poll_interval'], s['poll_max_interval'], s['poll_timeout']).start()
+        self.uploader = MagnetUploader(self.client.upload_magnets, self.on_magnet_uploaded, self.scheduler.fail,
+                                       self.log, s['upload_window'], s['upload_batch_size']).start()
+        self.space = SpaceReserver([self.publisher.work, self.publisher.library], self.scheduler.resume,
+                                   self.scheduler.fail, s['min_free_space'], self.log, s['space_interval']).start()
+        self.reporter.start()
+        self.transfers.start().follow(read_bandwidth)
+        self.recover_jobs()
+        return self
+
+    def submit(self, path):
+        # Before start() has run, the watch folder scan picks the file up.
+        if self.scheduler and os.path.exists(path):
+            self.scheduler.submit(Job(path))
+
+    def load_torrent(self, path):
+        try:
+            return torrent_meta.load(path)
+        except Exception as e:
+            self.log.error(f"❌ Failed to parse torrent {os.path.basename(path)}: {e}")
+            return None
+
+    def is_duplicate_from_tag(self, tag):
+        match, file = self.library.lookup(tag)
+        if match == "same":
+            self.log.info(f"✅ Duplicate ROM detected in library: {file}")
+        elif match == "newer":
+            self.log.info(f"✅ Newer version already in library: {file}")
+        return match is not None
+
+    def unlock_link(self, entry):
+        try:
+            data = self.client.unlock(entry.get("link"))
+            return {
+                "link": entry.get("link"),
+                "url": data["link"],
+                "name": data["filename"],
+                "size": data.get("filesize", 1),
+            }
+        except AllDebridError as e:
+            self.log.error(f"Unlock failed: {e}")
+        except Exception as e:
+            self.log.error(f"Unlock error: {e}")
+        return None
+
+    def relock(self, unlocked):
+        # Download URLs expire; resume against a freshly unlocked one.
+        fresh = self.unlock_link(unlocked)
+        return fresh["url"] if fresh else None
+
+    def download_unlocked(self, unlocked, meta=None):
+        s = self.settings
+        try:
+            url, name, size = unlocked["url"], unlocked["name"], unlocked["size"]
+            dest = self.publisher.work_path(name)
+            verifier = PieceVerifier.for_file(meta, name, size) if s['verify'] else None
+            if s['verify'] and verifier is None:
+                self.log.warning(f"⚠️ {name}: can't be matched to one file of the torrent — "
+                                 f"downloading without piece verification")
+
+            d = Download(url, dest, size, s['segments'], s['min_segment'], s['chunk_size'], self.reporter, self.log,
+                         refresh=lambda: self.relock(unlocked), retries=s['retries'], verifier=verifier,
+                         transfers=self.transfers)
+            d.run()
+            speed = (d.downloaded - d.resumed) / 1024 / 1024 / max(time.time() - d.started, 0.1)
+            self.end_line()
+            self.log.info(f"✅ Finished: {name} | Speed: {speed:.2f} MB/s | Size: {size / (1024 * 1024):.2f} MB")
+            return True
+        except Exception as e:
+            self.end_line()
+            self.log.error(f"Download failed: {e}")
+            return False
+
+    def publish_file(self, name):
+        dest = self.publisher.work_path(name)
+        if self.rules.keeps(name):
+            # Only a complete file reaches the library, so the indexes can take it straight away.
+            final_path = self.publisher.publish(dest)
+            self.library.add(final_path)
+            if self.on_published:
+                self.on_published(final_path)
+            self.log.info(f"📁 Moved to library: {final_path}")
+        else:
+            os.remove(dest)
+            self.log.info(f"🧹 Deleted non-ROM file: {name}")
+
+    def locate(self, torrent_file):
+        # A finished file of the torrent: in the work folder, or published by an earlier run.
+        name = os.path.basename(torrent_file.path)
+        for path in (self.publisher.work_path(name), os.path.join(self.publisher.library, name)):
+            try:
+                if os.path.getsize(path) == torrent_file.length:
+                    return path
+            except OSError:
+                pass
+        return None
+
+    # Pipeline stages, run per torrent by the JobScheduler
+    def read_torrent(self, job):
+        job.meta = self.load_torrent(job.path)
+        if job.meta:
+            job.info_hash, job.tag, job.magnet, job.title = job.meta.info_hash, job.meta.tag, job.meta.magnet, job.meta.name
+        return job.meta is not None
+
+    def stage_parse(self, job):
+        self.log.info(f"📄 Found torrent: {job.name}")
+        if not self.read_torrent(job):
+            raise JobFailed("could not build magnet")
+
+    def stage_dedupe(self, job):
+        if not job.tag:
+            self.log.warning(f"❓ No valid ROM tag found in {job.name} — allowing download.")
+        elif self.is_duplicate_from_tag(job.tag):
+            self.log.info(f"⚠️ Duplicate detected: {job.tag} — skipping.")
+            os.remove(job.path)
+            return DONE
+
+    def stage_upload(self, job):
+        self.uploader.add(job)
+        return WAIT
+
+    def on_magnet_uploaded(self, job, uploaded):
+        job.magnet_id = uploaded["id"]
+        job.ready = bool(uploaded.get("ready"))
+        self.scheduler.resume(job)
+
+    def stage_wait_ready(self, job):
+        self.poller.watch(job)
+        return WAIT
+
+    def on_magnet_ready(self, job, links):
+        if not links:
+            return self.scheduler.fail(job, f"magnet {job.magnet_id} has no links")
+        job.links = links
+        self.scheduler.resume(job)
+
+    def stage_unlock(self, job):
+        # Files finished before a restart are not unlocked or downloaded again.
+        store = self.store
+        outcomes = store.outcomes(job.info_hash) if store and job.info_hash else {}
+        links = [link for link in job.links if outcomes.get(link.get("link")) != "done"]
+        if len(links) < len(job.links):
+            self.log.info(f"↪️ {job.name}: {len(job.links) - len(links)} file(s) already downloaded")
+        links, skipped = self.rules.select(links)
+        if skipped:
+            self.log.info(f"🧾 {job.name}: {len(links)} file(s) selected, {len(skipped)} skipped — "
+                          + ", ".join(f"{link.get('filename')} ({reason})" for link, reason in skipped))
+            if store:
+                for link, reason in skipped:
+                    store.file_outcome(job, link.get("link"), link.get("filename"), link.get("size"), "skipped")
+        job.files = [u for u in (self.unlock_link(link) for link in links) if u]
+        if len(job.files) < len(links):
+            raise JobFailed(f"unlocked {len(job.files)} of {len(links)} links")
+
+    def space_needed(self, job):
+        # Unlock filesize values where AllDebrid gave them, the rest of the torrent's size otherwise.
+        known = [u for u in job.files if (u["size"] or 0) > 1]
+        files = [(self.publisher.work_path(u["name"]) + '.part', u["size"]) for u in known]
+        if len(known) < len(job.files) and job.meta:
+            files.append((None, max(0, job.meta.total_size - sum(u["size"] for u in known))))
+        return files
+
+    def stage_reserve(self, job):
+        self.space.admit(job, self.space_needed(job))
+        return WAIT
+
+    def download_file(self, job, unlocked, results):
+        ok = self.download_unlocked(unlocked, job.meta)
+        results[unlocked["name"]] = ok
+        self.space.release(job, self.publisher.work_path(unlocked["name"]) + '.part')
+        if self.store and not ok:
+            self.store.file_outcome(job, unlocked["link"], unlocked["name"], unlocked["size"], "failed")
+
+    def stage_download(self, job):
+        # Files go to the TransferScheduler and the job is parked, so a long download
+        # never ties up a pipeline worker; the last file to finish moves the job on.
+        if not job.files:
+            self.space.release(job)
+            return
+        results = {}
+        remaining = [len(job.files)]
+        lock = threading.Lock()
+
+        def file_done(future):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            self.space.release(job)
+            failed = [u["name"] for u in job.files if not results.get(u["name"])]
+            if failed:
+                self.scheduler.fail(job, f"{len(failed)} file(s) incomplete: {', '.join(failed)}")
+            else:
+                self.scheduler.resume(job)
+
+        futures = [self.transfers.submit(functools.partial(self.download_file, job, u, results),
+                                         transfer_priority(u), u["name"]) for u in job.files]
+        for future in futures:
+            future.add_done_callback(file_done)
+        return WAIT
+
+    def stage_publish(self, job):
+        # Downloads wait in the work folder until the whole job is there, so the pieces
+        # each file shares with its neighbours can be checked before any of them is
+        # promoted. Files in a failed piece are removed and fetched again on retry.
+        bad, unchecked = set(), {}
+        if self.settings['verify'] and job.meta:
+            bad, unchecked = check_shared_pieces(job.meta, self.locate)
+        failed = []
+        for u in job.files:
+            f = match_file(job.meta, u["name"], u["size"])
+            if f and f.path in bad:
+                os.remove(self.publisher.work_path(u["name"]))
+                failed.append(u["name"])
+                outcome = "failed"
+            else:
+                if f and unchecked.get(f.path):
+                    self.log.warning(f"⚠️ {u['name']}: {unchecked[f.path] / (1024 * 1024):.2f} MB in pieces shared "
+                                     f"with files not downloaded could not be verified")
+                self.publish_file(u["name"])
+                outcome = "done"
+            if self.store:
+                self.store.file_outcome(job, u["link"], u["name"], u["size"], outcome)
+        if failed:
+            raise JobFailed(f"pieces shared between files failed verification: {', '.join(failed)}")
+
+    def stage_finalize(self, job):
+        shutil.move(job.path, os.path.join(self.complete_folder, job.name))
+        self.log.info(f"📦 Completed torrent: {job.name}")
+
+    def recover_jobs(self):
+        # Re-enter jobs an earlier run left mid-pipeline, checked against the magnets
+        # already on the account so nothing is uploaded or polled for twice.
+        rows = self.store.in_flight()
+        if not rows:
+            return
+        try:
+            magnets = self.client.magnet_status()
+        except Exception as e:
+            self.log.warning(f"⚠️ Could not list account magnets, re-uploading interrupted jobs: {e}")
+            magnets = []
+        by_id = {str(m.get("id")): m for m in magnets}
+        by_hash = {str(m.get("hash", "")).lower(): m for m in magnets}
+        for row in rows:
+            job = Job(row["path"])
+            job.info_hash = row["info_hash"]
+            if not os.path.exists(job.path) or not self.read_torrent(job):
+                self.store.finish(job, "failed")
+                continue
+            magnet = by_id.get(row["magnet_id"]) or by_hash.get(job.info_hash)
+            if row["stage"] in ("dedupe", "finalize"):
+                stage = row["stage"]
+            elif magnet is None or magnet.get("statusCode", 0) >= 5:
+                stage = "upload"
+            elif (magnet.get("status") == "Ready" or magnet.get("statusCode") == 4) and magnet.get("links"):
+                job.magnet_id, job.links = magnet.get("id"), magnet["links"]
+                stage = "unlock"
+            else:
+                job.magnet_id = magnet.get("id")
+                stage = "wait-ready"
+            if self.scheduler.restore(job, stage):
+                self.log.info(f"♻️ Recovered {job.name} at {stage}")
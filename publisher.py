@@ -0,0 +1,84 @@
+import os, errno, shutil, logging
+import metrics
+
+STAGING = '.staging'
+COPY_CHUNK = 1024 * 1024 * 1024
+
+PUBLISH_SECONDS = metrics.histogram('alldebrid_publish_seconds', "Time to move a download into the library",
+                                    ('method',))
+
+
+def kernel_copy(src, dst):
+    # Copy with copy_file_range (or sendfile) so the data never passes through user
+    # space; plain buffered copying is only the last resort (e.g. on Windows).
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        infd, outfd = fin.fileno(), fout.fileno()
+        size = os.fstat(infd).st_size
+        offset = 0
+        for method in ('copy_file_range', 'sendfile'):
+            call = getattr(os, method, None)
+            if call is None:
+                continue
+            try:
+                os.lseek(outfd, offset, os.SEEK_SET)
+                while offset < size:
+                    count = min(COPY_CHUNK, size - offset)
+                    if method == 'copy_file_range':
+                        n = call(infd, outfd, count, offset, offset)
+                    else:
+                        n = call(outfd, infd, offset, count)
+                    if not n:
+                        break
+                    offset += n
+                break
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF,
+                                   errno.ENOTSOCK):
+                    raise
+        if offset < size:
+            fin.seek(offset)
+            fout.seek(offset)
+            shutil.copyfileobj(fin, fout, 16 * 1024 * 1024)
+        fout.flush()
+        os.fsync(outfd)
+        if os.fstat(outfd).st_size != size:
+            raise IOError(f"copy of {os.path.basename(src)} is incomplete")
+
+
+class LibraryPublisher:
+    # Moves finished downloads into the library so they appear there whole or not at
+    # all. Downloads can be written straight into a hidden staging directory inside the
+    # library (`stage_in_library`), making publishing a single atomic rename; when the
+    # work folder is on another filesystem the file is kernel-copied into staging first
+    # and then renamed into place.
+    def __init__(self, library_folder, downloads_folder, stage_in_library=True, log=None):
+        self.library = library_folder
+        self.staging = os.path.join(library_folder, STAGING)
+        self.log = log or logging.getLogger(__name__)
+        os.makedirs(self.staging, exist_ok=True)
+        self.work = self.staging if stage_in_library else downloads_folder
+        self.same_device = os.stat(self.work).st_dev == os.stat(self.library).st_dev
+        self.log.info(f"📂 Downloading into {self.work} "
+                      f"({'rename' if self.same_device else 'copy'} into {self.library})")
+
+    def work_path(self, name):
+        return os.path.join(self.work, name)
+
+    def publish(self, path):
+        name = os.path.basename(path)
+        final = os.path.join(self.library, name)
+        if self.same_device:
+            with PUBLISH_SECONDS.time('rename'):
+                os.replace(path, final)
+            return final
+        tmp = os.path.join(self.staging, name + '.copy')
+        try:
+            with PUBLISH_SECONDS.time('copy'):
+                kernel_copy(path, tmp)
+                os.replace(tmp, final)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        os.remove(path)
+        return final
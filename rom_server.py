@@ -0,0 +1,314 @@
+import os, io, re, html, json, base64, socket, threading, logging, uuid, http.server
+from contextlib import contextmanager
+from email.utils import formatdate
+from functools import partial
+from urllib.parse import parse_qs, quote, urlsplit
+import metrics
+
+MAX_RANGES = 16
+METRICS_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+REQUESTS = metrics.counter('alldebrid_tinfoil_requests_total', "Tinfoil server requests by route", ('route',))
+SENT_BYTES = metrics.counter('alldebrid_tinfoil_sent_bytes_total', "File bytes served to Tinfoil clients")
+
+
+def parse_range(header, size):
+    # Returns a list of (start, end) inclusive byte ranges, [] for an unsatisfiable
+    # header, or None when there is no usable Range header (serve the whole file).
+    # More than MAX_RANGES ranges after merging also get the whole file.
+    match = re.fullmatch(r"\s*bytes\s*=\s*(.+)", header or '')
+    if not match:
+        return None
+    ranges = []
+    for part in match.group(1).split(','):
+        part = part.strip()
+        m = re.fullmatch(r"(\d*)\s*-\s*(\d*)", part)
+        if not m or (not m.group(1) and not m.group(2)):
+            return None
+        if not m.group(1):
+            length = int(m.group(2))
+            if length:
+                ranges.append((max(0, size - length), size - 1))
+            continue
+        start = int(m.group(1))
+        end = min(int(m.group(2)), size - 1) if m.group(2) else size - 1
+        if m.group(2) and int(m.group(2)) < start:
+            return None
+        if start < size:
+            ranges.append((start, end))
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    if len(merged) > MAX_RANGES:
+        return None
+    return merged
+
+
+def is_hidden(directory, path):
+    # Hidden entries (the library's download staging area) are never listed or served.
+    relative = os.path.relpath(path, directory)
+    return relative != '.' and any(part.startswith('.') for part in relative.split(os.sep))
+
+
+class HiddenEntriesMixin:
+    # For SimpleHTTPRequestHandler subclasses: directory listings leave out hidden entries.
+    def list_directory(self, path):
+        try:
+            names = sorted((n for n in os.listdir(path) if not n.startswith('.')), key=str.lower)
+        except OSError:
+            self.send_error(404, "No permission to list directory")
+            return None
+        title = html.escape(self.path.split('?', 1)[0], quote=False)
+        items = "".join(f'<li><a href="{quote(name + ("/" if os.path.isdir(os.path.join(path, name)) else ""))}">'
+                        f'{html.escape(name, quote=False)}</a></li>\n' for name in names)
+        body = (f'<!DOCTYPE HTML>\n<html lang="en">\n<head>\n<meta charset="utf-8">\n'
+                f'<title>Directory listing for {title}</title>\n</head>\n<body>\n'
+                f'<h1>Directory listing for {title}</h1>\n<hr>\n<ul>\n{items}</ul>\n<hr>\n</body>\n</html>\n')
+        encoded = body.encode('utf-8', 'surrogateescape')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(encoded)))
+        self.end_headers()
+        return io.BytesIO(encoded)
+
+
+class RomRequestHandler(HiddenEntriesMixin, http.server.SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "RomServer/1.0"
+    timeout = 120
+
+    def do_HEAD(self):
+        if self.auth_check(head=True):
+            self.route(head=True)
+
+    def do_GET(self):
+        if self.auth_check(head=False):
+            self.route(head=False)
+
+    def route(self, head):
+        request_path = self.path.split('?', 1)[0]
+        if self.server.shop and request_path in self.server.shop_paths:
+            REQUESTS.labels('shop').inc()
+            return self.send_shop(head)
+        if self.server.stats and request_path == self.server.stats_path:
+            REQUESTS.labels('stats').inc()
+            return self.send_stats(head)
+        if self.server.metrics and request_path == self.server.metrics_path:
+            REQUESTS.labels('metrics').inc()
+            return self.send_metrics(head)
+        path = self.translate_path(self.path)
+        if is_hidden(self.directory, path):
+            return self.send_error(404, "File not found")
+        if os.path.isdir(path):
+            REQUESTS.labels('listing').inc()
+            return super().do_HEAD() if head else super().do_GET()
+        REQUESTS.labels('file').inc()
+        self.send_file(path, head)
+
+    def auth_check(self, head=False):
+        expected = self.server.auth
+        if expected and self.headers.get('Authorization') != expected:
+            body = b"Unauthorized"
+            self.send_response(401)
+            self.send_header('WWW-Authenticate', 'Basic realm="Tinfoil ROMs"')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if not head:
+                self.wfile.write(body)
+            return False
+        return True
+
+    def send_shop(self, head):
+        status, headers, body = self.server.shop.response(self.headers.get('If-None-Match'),
+                                                          self.headers.get('Accept-Encoding'))
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        if body and not head:
+            self.wfile.write(body)
+
+    def send_stats(self, head):
+        query = parse_qs(urlsplit(self.path).query)
+        try:
+            days = int(query.get('days', ['7'])[0])
+        except ValueError:
+            days = 7
+        body = json.dumps(self.server.stats.summary(days)).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def send_metrics(self, head):
+        body = self.server.metrics.render()
+        self.send_response(200)
+        self.send_header('Content-Type', METRICS_TYPE)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def client_ip(self):
+        # X-Forwarded-For is only taken from a trusted reverse proxy; from anyone else a
+        # fresh value per request would get around the per-client transfer cap.
+        ip = self.client_address[0]
+        if ip in self.server.trusted_proxies:
+            for hop in reversed(self.headers.get('X-Forwarded-For', '').split(',')):
+                if hop.strip():
+                    ip = hop.strip()
+                    if ip not in self.server.trusted_proxies:
+                        break
+        return ip
+
+    def send_file(self, path, head):
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            return self.send_error(404, "File not found")
+        with f:
+            st = os.fstat(f.fileno())
+            size = st.st_size
+            etag = f'"{st.st_mtime_ns:x}-{size:x}"'
+            ranges = parse_range(self.headers.get('Range'), size)
+            if ranges is not None and self.headers.get('If-Range') not in (None, etag):
+                ranges = None
+            if ranges == []:
+                self.send_response(416)
+                self.send_header('Content-Range', f"bytes */{size}")
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            with self.server.transfer_slot(self.client_ip()) as admitted:
+                if not admitted:
+                    body = b"Too many concurrent transfers"
+                    self.send_response(503)
+                    self.send_header('Retry-After', '5')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    if not head:
+                        self.wfile.write(body)
+                    return
+                self._send_body(f, path, size, etag, st.st_mtime, ranges, head)
+
+    def _send_body(self, f, path, size, etag, mtime, ranges, head):
+        ctype = self.guess_type(path)
+        if not ranges:
+            self.send_response(200)
+            self.send_header('Content-Type', ctype)
+            self.send_header('Content-Length', str(size))
+            parts = [(None, 0, size)]
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            self.send_response(206)
+            self.send_header('Content-Type', ctype)
+            self.send_header('Content-Range', f"bytes {start}-{end}/{size}")
+            self.send_header('Content-Length', str(end - start + 1))
+            parts = [(None, start, end - start + 1)]
+        else:
+            boundary = uuid.uuid4().hex
+            parts = []
+            length = 0
+            for start, end in ranges:
+                head_bytes = (f"\r\n--{boundary}\r\nContent-Type: {ctype}\r\n"
+                              f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n").encode()
+                parts.append((head_bytes, start, end - start + 1))
+                length += len(head_bytes) + end - start + 1
+            tail = f"\r\n--{boundary}--\r\n".encode()
+            length += len(tail)
+            parts.append((tail, 0, 0))
+            self.send_response(206)
+            self.send_header('Content-Type', f"multipart/byteranges; boundary={boundary}")
+            self.send_header('Content-Length', str(length))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', formatdate(mtime, usegmt=True))
+        self.end_headers()
+        if head:
+            return
+        sent = 0
+        try:
+            for prefix, offset, count in parts:
+                if prefix:
+                    self.wfile.write(prefix)
+                if count:
+                    # socket.sendfile() uses os.sendfile (zero-copy) where the OS has it.
+                    sent += self.connection.sendfile(f, offset, count)
+        finally:
+            SENT_BYTES.inc(sent)
+            if self.server.stats and sent:
+                self.server.stats.record(self.client_ip(), path, sent)
+
+    def log_message(self, format, *args):
+        self.server.log.debug(f"{self.client_ip()} {format % args}")
+
+
+class RomServer(http.server.ThreadingHTTPServer):
+    # HTTP/1.1 keep-alive file server for the library. Every connection gets its own
+    # thread, so idle keep-alive clients never hold back new ones; file transfers are
+    # capped at `workers` in total and `per_client` per client, so one console pulling
+    # a large .xci can't starve the rest. X-Forwarded-For identifies the client only on
+    # connections from one of `trusted_proxies`.
+    # With a ShopIndex, `shop_paths` answer with the cached Tinfoil JSON index; with a
+    # StatsStore, served bytes are recorded and `stats_path` returns a summary; with a
+    # metrics registry, `metrics_path` serves it in the Prometheus text format.
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, directory, user=None, password=None, workers=16, per_client=2,
+                 log=None, handler=RomRequestHandler, shop=None, shop_paths=('/shop.json',),
+                 stats=None, stats_path='/stats.json', metrics=None, metrics_path='/metrics',
+                 trusted_proxies=()):
+        self.log = log or logging.getLogger(__name__)
+        self.directory = directory
+        self.shop = shop
+        self.shop_paths = tuple(shop_paths)
+        self.stats = stats
+        self.stats_path = stats_path
+        self.metrics = metrics
+        self.metrics_path = metrics_path
+        self.auth = None
+        if user or password:
+            self.auth = "Basic " + base64.b64encode(f"{user}:{password}".encode()).decode()
+        self.per_client = max(1, int(per_client))
+        self.transfers = threading.BoundedSemaphore(max(1, int(workers)))
+        self.trusted_proxies = frozenset(trusted_proxies)
+        self.clients = {}
+        self.clients_lock = threading.Lock()
+        super().__init__(address, partial(handler, directory=directory))
+
+    def server_bind(self):
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        super().server_bind()
+
+    def handle_error(self, request, client_address):
+        self.log.debug(f"Connection from {client_address[0]} dropped", exc_info=True)
+
+    @contextmanager
+    def transfer_slot(self, client):
+        with self.clients_lock:
+            active = self.clients.get(client, 0)
+            admitted = active < self.per_client
+            if admitted:
+                self.clients[client] = active + 1
+        try:
+            if not admitted:
+                yield False
+                return
+            # Past the per-client check, wait for one of the `workers` transfer slots.
+            with self.transfers:
+                yield True
+        finally:
+            if admitted:
+                with self.clients_lock:
+                    self.clients[client] -= 1
+                    if not self.clients[client]:
+                        del self.clients[client]
@@ -0,0 +1,160 @@
+import os, time, queue, threading, logging
+import metrics
+
+# Stage return values. A stage that returns nothing advances to the next stage.
+NEXT = 'next'
+DONE = 'done'
+WAIT = 'wait'    # job was handed off; whoever holds it calls resume() or fail()
+
+
+STAGE_SECONDS = metrics.histogram('alldebrid_stage_seconds', "Time jobs spend in each pipeline stage, waits included",
+                                  ('stage',))
+JOBS = metrics.counter('alldebrid_jobs_total', "Jobs that left the pipeline, by last stage and result",
+                       ('stage', 'result'))
+
+
+class JobFailed(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.stage = None
+        self.meta = None
+        self.info_hash = None
+        self.tag = None
+        self.magnet = None
+        self.title = None
+        self.magnet_id = None
+        self.ready = False
+        self.links = []
+        self.files = []
+        self.created = time.time()
+        self.entered = None
+
+    def __repr__(self):
+        return f"<Job {self.name} @ {self.stage}>"
+
+
+class JobScheduler:
+    # Runs each job through `stages` (list of (name, fn)) on a pool of worker threads.
+    # Workers only ever run one stage at a time, so a job that is waiting on AllDebrid
+    # never holds back one that is ready. With a JobStore, every job is saved as it
+    # enters each stage so an interrupted run can be picked up with restore().
+    def __init__(self, stages, threads=4, log=None, retry_delay=30, store=None):
+        self.stages = list(stages)
+        self.threads = max(1, int(threads))
+        self.log = log or logging.getLogger(__name__)
+        self.retry_delay = retry_delay
+        self.store = store
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.active = {}
+        self.failed = {}
+        self.workers = []
+
+    def start(self):
+        for i in range(self.threads):
+            t = threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+            t.start()
+            self.workers.append(t)
+        return self
+
+    def submit(self, job):
+        with self.lock:
+            if job.name in self.active:
+                return False
+            if time.time() - self.failed.get(job.name, 0) < self.retry_delay:
+                return False
+            self.failed.pop(job.name, None)
+            self.active[job.name] = job
+        self.queue.put((job, 0))
+        return True
+
+    def restore(self, job, stage):
+        # Re-enter a job recovered from the store at `stage`.
+        with self.lock:
+            if job.name in self.active:
+                return False
+            self.active[job.name] = job
+        self.queue.put((job, max(0, self._index(stage))))
+        return True
+
+    def is_active(self, name):
+        with self.lock:
+            return name in self.active
+
+    def pending(self):
+        with self.lock:
+            return len(self.active)
+
+    def resume(self, job):
+        # Continue a WAITing job with the stage after the one that parked it.
+        self._timed(job)
+        self.queue.put((job, self._index(job.stage) + 1))
+
+    def fail(self, job, reason):
+        self.log.error(f"❌ {job.name} failed at {job.stage}: {reason}")
+        self._timed(job)
+        JOBS.labels(job.stage, 'failed').inc()
+        with self.lock:
+            self.active.pop(job.name, None)
+            self.failed[job.name] = time.time()
+        self._record(job, 'failed')
+
+    def _index(self, stage):
+        for i, (name, _) in enumerate(self.stages):
+            if name == stage:
+                return i
+        return -1
+
+    def _timed(self, job):
+        if job.entered is not None:
+            STAGE_SECONDS.labels(job.stage).observe(time.monotonic() - job.entered)
+            job.entered = None
+
+    def _record(self, job, state):
+        if not self.store:
+            return
+        try:
+            if state == 'active':
+                self.store.save(job)
+            else:
+                self.store.finish(job, state)
+        except Exception as e:
+            self.log.warning(f"⚠️ Could not save {job.name}: {e}")
+
+    def _finish(self, job):
+        with self.lock:
+            self.active.pop(job.name, None)
+        JOBS.labels(job.stage, 'done').inc()
+        self._record(job, 'done')
+
+    def _worker(self):
+        while True:
+            job, index = self.queue.get()
+            try:
+                self._run(job, index)
+            finally:
+                self.queue.task_done()
+
+    def _run(self, job, index):
+        while index < len(self.stages):
+            job.stage, fn = self.stages[index]
+            self._record(job, 'active')
+            job.entered = time.monotonic()
+            try:
+                result = fn(job)
+            except JobFailed as e:
+                return self.fail(job, e)
+            except Exception as e:
+                return self.fail(job, f"{type(e).__name__}: {e}")
+            if result == WAIT:
+                return
+            self._timed(job)
+            if result == DONE:
+                break
+            index += 1
+        self._finish(job)
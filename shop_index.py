@@ -0,0 +1,104 @@
+import os, gzip, json, time, hashlib, threading, logging
+from urllib.parse import quote
+from watcher import observe
+from file_rules import ROM_EXTENSIONS
+
+
+class ShopIndex:
+    # Tinfoil-format JSON index of the library ({"files": [{"url", "size"}]}), built
+    # with one scan and then kept current by add()/remove() and filesystem events.
+    # The encoded body, its gzip form and a strong ETag are rendered once per change,
+    # so serving an unchanged index costs no filesystem work at all.
+    def __init__(self, folder, url_prefix='', log=None, extensions=ROM_EXTENSIONS, success=None):
+        self.folder = folder
+        self.url_prefix = url_prefix
+        self.log = log or logging.getLogger(__name__)
+        self.extensions = tuple(extensions) if extensions else None
+        self.success = success
+        self.lock = threading.Lock()
+        self.sizes = {}
+        self.rendered = None
+        self.observer = None
+
+    def build(self):
+        sizes = {}
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if self.wanted(entry.name) and entry.is_file():
+                    sizes[entry.name] = entry.stat().st_size
+        with self.lock:
+            self.sizes = sizes
+            self.rendered = None
+        self.log.info(f"🛒 Shop index: {len(sizes)} file(s)")
+        return self
+
+    def watch(self, rescan_interval=300):
+        self.observer = observe(self.folder, self.add, self.remove, self.log)
+        if not self.observer:
+            threading.Thread(target=self._rescan, args=(rescan_interval,), name="shop-rescan", daemon=True).start()
+        return self
+
+    def wanted(self, name):
+        if name.startswith('.'):
+            return False
+        return not self.extensions or name.lower().endswith(self.extensions)
+
+    def add(self, path):
+        name = os.path.basename(path)
+        if not self.wanted(name):
+            return
+        try:
+            size = os.path.getsize(os.path.join(self.folder, name))
+        except OSError:
+            return self.remove(name)
+        with self.lock:
+            if self.sizes.get(name) != size:
+                self.sizes[name] = size
+                self.rendered = None
+
+    def remove(self, path):
+        name = os.path.basename(path)
+        with self.lock:
+            if self.sizes.pop(name, None) is not None:
+                self.rendered = None
+
+    def files(self):
+        with self.lock:
+            return sorted(self.sizes.items())
+
+    def render(self):
+        # Returns (body, gzipped body, etag), re-encoding only after a change.
+        with self.lock:
+            if self.rendered is None:
+                shop = {"files": [{"url": f"{self.url_prefix}{quote(name)}#{quote(name)}", "size": size}
+                                  for name, size in sorted(self.sizes.items())]}
+                if self.success:
+                    shop["success"] = self.success
+                body = json.dumps(shop, separators=(',', ':')).encode('utf-8')
+                etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+                self.rendered = (body, gzip.compress(body, 6, mtime=0), etag)
+            return self.rendered
+
+    def response(self, if_none_match=None, accept_encoding=None):
+        # (status, headers, body) for an index request; each encoding gets its own strong ETag.
+        body, gzipped, etag = self.render()
+        use_gzip = 'gzip' in (accept_encoding or '')
+        if use_gzip:
+            body, etag = gzipped, etag[:-1] + '-gz"'
+        headers = {'Content-Type': 'application/json', 'ETag': etag, 'Cache-Control': 'no-cache',
+                   'Vary': 'Accept-Encoding'}
+        tags = [t.strip() for t in (if_none_match or '').split(',')]
+        if etag in tags or '*' in tags:
+            return 304, headers, b''
+        if use_gzip:
+            headers['Content-Encoding'] = 'gzip'
+        headers['Content-Length'] = str(len(body))
+        return 200, headers, body
+
+    def _rescan(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.build()
+            except OSError as e:
+                self.log.warning(f"⚠️ Shop index rescan failed: {e}")
@@ -0,0 +1,118 @@
+import os, time, sqlite3, datetime, threading, logging
+from library_index import parse_tag
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS served (
+    day TEXT NOT NULL,
+    client TEXT NOT NULL,
+    title TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    requests INTEGER NOT NULL DEFAULT 0,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, client, filename)
+);
+CREATE INDEX IF NOT EXISTS served_title ON served (title, day);
+"""
+
+
+class StatsStore:
+    # Download statistics for the ROM servers. record() only appends to an in-memory
+    # buffer; a background thread folds the buffer into per-day/client/file rows of an
+    # SQLite database (WAL mode) every `flush_interval` seconds, and optionally appends
+    # the same events to a plain-text log in one write.
+    def __init__(self, path='stats.db', flush_interval=5, log_file=None, log=None):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.log_file = log_file
+        self.log = log or logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.pending = []
+        db = self._connect()
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+        finally:
+            db.close()
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def start(self):
+        threading.Thread(target=self._run, name="stats-flush", daemon=True).start()
+        return self
+
+    def record(self, client, filename, nbytes):
+        with self.lock:
+            self.pending.append((time.time(), client, os.path.basename(filename), nbytes))
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                self.log.error(f"⚠️ Stats flush failed: {e}")
+
+    def flush(self):
+        with self.lock:
+            events, self.pending = self.pending, []
+        if not events:
+            return 0
+        rows = {}
+        lines = []
+        for ts, client, filename, nbytes in events:
+            stamp = datetime.datetime.fromtimestamp(ts)
+            parsed = parse_tag(filename)
+            title = parsed[0] if parsed else filename
+            key = (stamp.strftime('%Y-%m-%d'), client, title, filename)
+            count, total = rows.get(key, (0, 0))
+            rows[key] = (count + 1, total + nbytes)
+            lines.append(f"[{stamp.strftime('%Y-%m-%d %H:%M:%S')}] {client} downloaded {filename}\n")
+        with self.flush_lock:
+            db = self._connect()
+            try:
+                with db:
+                    db.executemany(
+                        "INSERT INTO served (day, client, title, filename, requests, bytes) VALUES (?, ?, ?, ?, ?, ?) "
+                        "ON CONFLICT (day, client, filename) DO UPDATE SET "
+                        "requests = requests + excluded.requests, bytes = bytes + excluded.bytes",
+                        [key + value for key, value in rows.items()])
+            finally:
+                db.close()
+        if self.log_file:
+            with open(self.log_file, 'a', encoding='utf-8') as f:
+                f.writelines(lines)
+        return len(events)
+
+    def _query(self, sql, args):
+        db = self._connect()
+        try:
+            return db.execute(sql, args).fetchall()
+        finally:
+            db.close()
+
+    def since(self, days):
+        return (datetime.date.today() - datetime.timedelta(days=max(0, days - 1))).isoformat()
+
+    def top_titles(self, days=7, limit=20):
+        rows = self._query("SELECT title, MIN(filename), SUM(requests), SUM(bytes) FROM served WHERE day >= ? "
+                           "GROUP BY title ORDER BY SUM(requests) DESC, SUM(bytes) DESC LIMIT ?",
+                           (self.since(days), limit))
+        return [{"title": t, "filename": f, "requests": r, "bytes": b} for t, f, r, b in rows]
+
+    def top_clients(self, days=7, limit=20):
+        rows = self._query("SELECT client, SUM(requests), SUM(bytes) FROM served WHERE day >= ? "
+                           "GROUP BY client ORDER BY SUM(bytes) DESC LIMIT ?", (self.since(days), limit))
+        return [{"client": c, "requests": r, "bytes": b} for c, r, b in rows]
+
+    def daily(self, days=30):
+        rows = self._query("SELECT day, SUM(requests), SUM(bytes), COUNT(DISTINCT client) FROM served "
+                           "WHERE day >= ? GROUP BY day ORDER BY day", (self.since(days),))
+        return [{"day": d, "requests": r, "bytes": b, "clients": c} for d, r, b, c in rows]
+
+    def summary(self, days=7, limit=20):
+        return {"days": days, "titles": self.top_titles(days, limit),
+                "clients": self.top_clients(days, limit), "daily": self.daily(days)}
@@ -1,8 +1,10 @@
-from flask import Flask, request, send_from_directory, abort, Response
+from flask import Flask, request, send_from_directory, abort, Response, jsonify
 import os
-import datetime
 import configparser
 from functools import wraps
+from shop_index import ShopIndex
+from stats import StatsStore
+from rom_server import is_hidden
 
 app = Flask(__name__)
 
@@ -13,6 +15,18 @@ LIBRARY_PATH = config.get('FOLDERS', 'library', fallback='C:/new.v1/library')
 USERNAME = config.get('ROMSERVER', 'tinuser')
 PASSWORD = config.get('ROMSERVER', 'tinpass')
 LOG_FILE = "download.log"
+STATS_DB = config.get('STATS', 'db', fallback='stats.db')
+STATS_FLUSH = config.getfloat('STATS', 'flush_interval', fallback=5)
+
+# Library listing kept in memory; serves both the HTML page and the Tinfoil JSON index
+shop = ShopIndex(LIBRARY_PATH, url_prefix='roms/', extensions=None)
+try:
+    shop.build().watch()
+except OSError as e:
+    print(f"⚠️ Library index unavailable: {e}")
+
+# Download statistics, flushed to SQLite (and download.log) in batches off the request path
+stats = StatsStore(STATS_DB, STATS_FLUSH, log_file=LOG_FILE).start()
 
 # Authentication utilities
 def check_auth(username, password):
@@ -34,32 +48,41 @@ def requires_auth(f):
     return decorated
 
 # Logging
-def log_download(ip, filename):
-    timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    log_line = f"[{timestamp}] {ip} downloaded {filename}"
-    print(log_line)
-    with open(LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(log_line + "\n")
+def log_download(ip, filename, size=0):
+    print(f"{ip} downloaded {filename}")
+    stats.record(ip, filename, size)
 
 @app.route('/roms/<path:filename>')
 @requires_auth
 def serve_rom(filename):
     file_path = os.path.join(LIBRARY_PATH, filename)
-    if not os.path.isfile(file_path):
+    # Hidden entries (the .staging folder of unfinished downloads) are never served
+    if is_hidden(LIBRARY_PATH, file_path) or not os.path.isfile(file_path):
         abort(404)
     client_ip = request.headers.get('X-Forwarded-For', request.remote_addr)
-    log_download(client_ip, filename)
+    log_download(client_ip, filename, os.path.getsize(file_path))
     return send_from_directory(LIBRARY_PATH, filename, as_attachment=True)
 
 @app.route('/')
 @requires_auth
 def index():
     try:
-        files = os.listdir(LIBRARY_PATH)
-        links = [f'<a href="/roms/{f}">{f}</a>' for f in files if os.path.isfile(os.path.join(LIBRARY_PATH, f))]
+        links = [f'<a href="/roms/{f}">{f}</a>' for f, _ in shop.files()]
         return "<h1>Available ROMs:</h1>" + "<br>".join(links)
     except Exception as e:
         return f"<h1>Error accessing library:</h1><pre>{e}</pre>"
 
+@app.route('/shop.json')
+@requires_auth
+def shop_json():
+    status, headers, body = shop.response(request.headers.get('If-None-Match'),
+                                          request.headers.get('Accept-Encoding'))
+    return Response(body, status, headers)
+
+@app.route('/stats')
+@requires_auth
+def stats_json():
+    return jsonify(stats.summary(request.args.get('days', 7, type=int)))
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
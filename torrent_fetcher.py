@@ -1,68 +1,45 @@
-
 import os
-import time
-import requests
+import logging
 from configparser import ConfigParser
-from bs4 import BeautifulSoup
 from requests.auth import HTTPBasicAuth
+from feed_fetcher import FeedFetcher
 
 config = ConfigParser()
 config.read('config.ini')
 
-server = "http://switch4pda.ru:8878"
+server = config.get('REMOTE', 'url', fallback="http://switch4pda.ru:8878")
 key = config.get('KEY', 'key')
 iD = config.get('KEY', 'id')
 WATCH_FOLDER = os.path.abspath('./watch')
 LOG_FILE = "torrent_watcher.log"
+INTERVAL = config.getfloat('REMOTE', 'interval', fallback=30)
+STATE_FILE = config.get('REMOTE', 'state_file', fallback='feed_state.json')
 
 if not os.path.exists(WATCH_FOLDER):
     os.makedirs(WATCH_FOLDER)
 
-def log(msg):
-    with open(LOG_FILE, 'a', encoding='utf-8') as f:
-        f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} | {msg}\n")
-
-def get_html(server, password):
-    while True:
-        try:
-            resp = requests.get(server, auth=HTTPBasicAuth("user", password))
-            return resp.text
-        except Exception:
-            time.sleep(5)
-
-def download_file(link, filename, password):
-    while True:
-        try:
-            resp = requests.get(link, auth=HTTPBasicAuth("user", password), stream=True)
-            if resp.status_code == 200:
-                with open(filename, 'wb') as f:
-                    for chunk in resp.iter_content(chunk_size=8192):
-                        f.write(chunk)
-                print(f"✅ Downloaded: {filename}")
-                log(f"Downloaded: {os.path.basename(filename)}")
-                return True
-        except Exception:
-            print("⚠️ Connection error, retrying...")
-            time.sleep(5)
+LOG = logging.getLogger("TorrentFetcher")
+LOG.setLevel(logging.INFO)
+fh = logging.FileHandler(LOG_FILE, encoding='utf-8')
+fh.setFormatter(logging.Formatter('%(asctime)s | %(message)s', '%Y-%m-%d %H:%M:%S'))
+LOG.addHandler(fh)
+ch = logging.StreamHandler()
+ch.setFormatter(logging.Formatter('%(message)s'))
+LOG.addHandler(ch)
+
+def torrent_name(text):
+    parts = text.split("_&&_")
+    if iD in text and key in text and len(parts) > 2:
+        return parts[2].replace(" ", "_")
+    return None
+
+fetcher = FeedFetcher(server, WATCH_FOLDER, torrent_name, auth=HTTPBasicAuth("user", key), state_path=STATE_FILE,
+                      log=LOG, workers=config.getint('REMOTE', 'workers', fallback=4),
+                      retries=config.getint('REMOTE', 'retries', fallback=3))
 
 def check_updates():
-    html = get_html(server, key)
-    soup = BeautifulSoup(html, "html.parser")
-    for a in soup.find_all('a', href=True):
-        name = a.text
-        link = server + "/" + a['href']
-        if iD in name and key in name:
-            filename = os.path.join(WATCH_FOLDER, name.split("_&&_")[2].replace(" ", "_"))
-            if not os.path.exists(filename):
-                log(f"Found new torrent: {os.path.basename(filename)}")
-                download_file(link, filename, key)
+    return fetcher.poll()
 
 if __name__ == "__main__":
     print("🚀 Torrent fetcher started, watching for updates...")
-    while True:
-        try:
-            check_updates()
-        except Exception as e:
-            print(f"⚠️ Error: {e}")
-            log(f"Error: {e}")
-        time.sleep(30)
+    fetcher.run(INTERVAL)
@@ -0,0 +1,126 @@
+import os, base64, hashlib, threading
+from collections import OrderedDict, namedtuple
+from urllib.parse import quote
+from library_index import parse_tag
+
+TorrentFile = namedtuple('TorrentFile', 'path length offset')
+
+
+class BencodeError(ValueError):
+    pass
+
+
+def _decode(data, i, spans=None):
+    # Minimal bencode decoder over bytes. When `spans` is given, the raw [start, end)
+    # span of every value in this (top-level) dictionary is recorded by key.
+    c = data[i:i + 1]
+    if c == b'i':
+        end = data.index(b'e', i)
+        return int(data[i + 1:end]), end + 1
+    if c == b'l':
+        i += 1
+        items = []
+        while data[i:i + 1] != b'e':
+            value, i = _decode(data, i)
+            items.append(value)
+        return items, i + 1
+    if c == b'd':
+        i += 1
+        result = {}
+        while data[i:i + 1] != b'e':
+            key, i = _decode(data, i)
+            start = i
+            result[key], i = _decode(data, i)
+            if spans is not None:
+                spans[key] = (start, i)
+        return result, i + 1
+    if c.isdigit():
+        colon = data.index(b':', i)
+        end = colon + 1 + int(data[i:colon])
+        if end > len(data):
+            raise BencodeError("string runs past end of data")
+        return data[colon + 1:end], end
+    raise BencodeError(f"unexpected byte {c!r} at {i}")
+
+
+def _text(value):
+    return value.decode('utf-8', errors='ignore') if isinstance(value, bytes) else str(value)
+
+
+class TorrentMeta:
+    def __init__(self, path, data):
+        self.path = path
+        spans = {}
+        try:
+            meta, _ = _decode(data, 0, spans)
+            info = meta[b'info']
+        except (IndexError, KeyError, ValueError, TypeError) as e:
+            raise BencodeError(f"{os.path.basename(path)}: {e}") from None
+        start, end = spans[b'info']
+        # Hash the info dict exactly as it appears in the file - no re-encoding.
+        digest = hashlib.sha1(memoryview(data)[start:end]).digest()
+        self.info_hash = digest.hex()
+        self.info_hash_b32 = base64.b32encode(digest).decode()
+        self.name = _text(info.get(b'name', b''))
+        self.piece_length = info.get(b'piece length', 0)
+        self.pieces = info.get(b'pieces', b'')
+        self.files = []
+        # Tags come from each file's own path parts; the folder name of a multi-file
+        # torrent often carries the base game's tag and must not stand in for its files.
+        tag_parts = []
+        offset = 0
+        if b'files' in info:
+            for entry in info[b'files']:
+                parts = [_text(p) for p in entry.get(b'path', [])]
+                self.files.append(TorrentFile('/'.join([self.name] + parts), entry[b'length'], offset))
+                tag_parts += parts
+                offset += entry[b'length']
+        else:
+            self.files.append(TorrentFile(self.name, info.get(b'length', 0), 0))
+            tag_parts.append(self.name)
+            offset = info.get(b'length', 0)
+        self.total_size = offset
+        self.trackers = []
+        for tier in [[meta.get(b'announce', b'')]] + meta.get(b'announce-list', []):
+            for tracker in tier:
+                url = _text(tracker)
+                if url and url not in self.trackers:
+                    self.trackers.append(url)
+        self.tags = []
+        for part in tag_parts:
+            parsed = parse_tag(part)
+            tag = parsed and f"[{parsed[0]}][v{parsed[1]}]"
+            if tag and tag not in self.tags:
+                self.tags.append(tag)
+
+    @property
+    def tag(self):
+        return self.tags[0] if self.tags else None
+
+    @property
+    def magnet(self):
+        uri = f"magnet:?xt=urn:btih:{self.info_hash_b32}&dn={quote(self.name, safe='')}"
+        return uri + ''.join(f"&tr={quote(t, safe='')}" for t in self.trackers)
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+CACHE_SIZE = 256
+
+
+def load(path):
+    # Parse once per (path, size, mtime); rescans and retries reuse the result.
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _cache_lock:
+        meta = _cache.get(key)
+        if meta is not None:
+            _cache.move_to_end(key)
+            return meta
+    with open(path, 'rb') as f:
+        meta = TorrentMeta(path, f.read())
+    with _cache_lock:
+        _cache[key] = meta
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return meta
@@ -0,0 +1,89 @@
+import time, queue, itertools, threading, logging
+from concurrent.futures import Future
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from alldebrid_client import TokenBucket
+import metrics
+
+ACTIVE = metrics.gauge('alldebrid_active_transfers', "File transfers currently running")
+
+
+class TransferScheduler:
+    # Process-wide budget for file transfers. At most `max_transfers` files download
+    # at once, lowest priority value first; each host gets at most `per_host` open
+    # connections (segments included); and all transfers share one token bucket of
+    # `bandwidth` bytes/s, which set_bandwidth() can change while they run.
+    def __init__(self, max_transfers=4, per_host=8, bandwidth=0, log=None):
+        self.max_transfers = max(1, int(max_transfers))
+        self.per_host = max(1, int(per_host))
+        self.log = log or logging.getLogger(__name__)
+        self.queue = queue.PriorityQueue()
+        self.order = itertools.count()
+        self.hosts = {}
+        self.hosts_lock = threading.Lock()
+        self.bucket = TokenBucket(0)
+        self.set_bandwidth(bandwidth)
+
+    def start(self):
+        for i in range(self.max_transfers):
+            threading.Thread(target=self._worker, name=f"transfer-{i}", daemon=True).start()
+        return self
+
+    def submit(self, fn, priority=0, name=None):
+        future = Future()
+        self.queue.put((priority, next(self.order), fn, future, name))
+        return future
+
+    def pending(self):
+        return self.queue.qsize()
+
+    def set_bandwidth(self, bandwidth):
+        # bytes/s shared by every transfer; 0 lifts the cap. Bursts are capped at one second's worth.
+        bandwidth = max(0, int(bandwidth))
+        self.bucket.set_rate(bandwidth, bandwidth or None)
+        self.bandwidth = bandwidth
+        self.log.info(f"🚦 Bandwidth cap: {f'{bandwidth / 1024 / 1024:.1f} MB/s' if bandwidth else 'off'}")
+
+    def follow(self, read, interval=10):
+        # Re-read the cap with read() every `interval` seconds so it can be changed live.
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    bandwidth = read()
+                except Exception as e:
+                    self.log.warning(f"⚠️ Could not re-read bandwidth cap: {e}")
+                    continue
+                if bandwidth != self.bandwidth:
+                    self.set_bandwidth(bandwidth)
+        threading.Thread(target=run, name="transfer-bandwidth", daemon=True).start()
+        return self
+
+    def throttle(self, n):
+        if self.bandwidth:
+            self.bucket.acquire(n)
+
+    @contextmanager
+    def connection(self, url):
+        host = urlsplit(url).netloc
+        with self.hosts_lock:
+            slot = self.hosts.get(host)
+            if slot is None:
+                slot = self.hosts[host] = threading.BoundedSemaphore(self.per_host)
+        with slot:
+            yield
+
+    def _worker(self):
+        while True:
+            priority, _, fn, future, name = self.queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            started = time.time()
+            ACTIVE.inc()
+            try:
+                future.set_result(fn())
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                ACTIVE.dec()
+                self.log.debug(f"Transfer {name} finished in {time.time() - started:.1f}s (priority {priority})")
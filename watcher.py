@@ -0,0 +1,161 @@
+import os, time, threading, logging
+
+
+class FolderWatcher:
+    # Hands new files ending in `suffix` to on_file(path) as soon as they have stopped
+    # growing for `settle` seconds. Uses inotify/ReadDirectoryChanges through watchdog,
+    # watchdog's PollingObserver where the filesystem sends no change notifications,
+    # and a plain listdir loop if watchdog is not installed. A slow rescan every
+    # `rescan_interval` seconds catches missed events and re-offers failed files.
+    # Files found by scans go through the same settle check as events.
+    def __init__(self, folder, on_file, log=None, suffix='.torrent', exclude=('.processed.torrent',),
+                 settle=1.0, poll_interval=5, rescan_interval=60, mode='auto'):
+        self.folder = folder
+        self.on_file = on_file
+        self.log = log or logging.getLogger(__name__)
+        self.suffix = suffix
+        self.exclude = tuple(exclude)
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.rescan_interval = rescan_interval
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.observer = None
+
+    def wanted(self, path):
+        name = os.path.basename(path)
+        return name.endswith(self.suffix) and not name.endswith(self.exclude)
+
+    def touch(self, path):
+        if self.wanted(path):
+            with self.lock:
+                self.pending[path] = (time.monotonic(), -1)
+
+    def scan(self):
+        for name in sorted(os.listdir(self.folder)):
+            path = os.path.join(self.folder, name)
+            if not self.wanted(path):
+                continue
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            with self.lock:
+                # Settled from the size seen now; an event already pending keeps its own clock.
+                self.pending.setdefault(path, (time.monotonic(), size))
+
+    def start(self):
+        self.observer = self._observer()
+        threading.Thread(target=self._debounce, name="watch-debounce", daemon=True).start()
+        return self
+
+    def run(self):
+        self.start()
+        self.scan()
+        interval = self.rescan_interval if self.observer else self.poll_interval
+        while True:
+            time.sleep(interval)
+            try:
+                self.scan()
+            except OSError as e:
+                self.log.warning(f"⚠️ Watch folder scan failed: {e}")
+
+    def _observer(self):
+        if self.mode == 'poll':
+            self.log.info(f"👀 Polling {self.folder} every {self.poll_interval}s")
+            return None
+        try:
+            from watchdog.observers import Observer
+            from watchdog.observers.polling import PollingObserver
+            from watchdog.events import FileSystemEventHandler
+        except ImportError:
+            self.log.warning(f"⚠️ watchdog not installed — polling {self.folder} every {self.poll_interval}s")
+            return None
+
+        watcher = self
+
+        class Handler(FileSystemEventHandler):
+            def on_created(self, event):
+                if not event.is_directory:
+                    watcher.touch(event.src_path)
+
+            def on_modified(self, event):
+                if not event.is_directory:
+                    watcher.touch(event.src_path)
+
+            def on_moved(self, event):
+                if not event.is_directory:
+                    watcher.touch(event.dest_path)
+
+        for cls in (Observer, PollingObserver):
+            try:
+                observer = cls(timeout=self.poll_interval) if cls is PollingObserver else cls()
+                observer.daemon = True
+                observer.schedule(Handler(), self.folder, recursive=False)
+                observer.start()
+                self.log.info(f"👀 Watching {self.folder} ({cls.__name__})")
+                return observer
+            except Exception as e:
+                self.log.warning(f"⚠️ {cls.__name__} unavailable for {self.folder}: {e}")
+        return None
+
+    def _debounce(self):
+        # A file is handed over once its size has held still across one settle period.
+        while True:
+            time.sleep(min(0.25, self.settle))
+            now = time.monotonic()
+            ready = []
+            with self.lock:
+                for path, (stamp, size) in list(self.pending.items()):
+                    if now - stamp < self.settle:
+                        continue
+                    try:
+                        current = os.path.getsize(path)
+                    except OSError:
+                        del self.pending[path]
+                        continue
+                    if current == size and current > 0:
+                        del self.pending[path]
+                        ready.append(path)
+                    else:
+                        self.pending[path] = (now, current)
+            for path in ready:
+                self.on_file(path)
+
+
+def observe(folder, on_added, on_removed, log=None):
+    # Follow files appearing in, changing in and leaving `folder`. Returns the running
+    # watchdog observer, or None when watchdog is not installed.
+    try:
+        from watchdog.observers import Observer
+        from watchdog.events import FileSystemEventHandler
+    except ImportError:
+        return None
+    root = os.path.abspath(folder)
+
+    class Handler(FileSystemEventHandler):
+        def on_created(self, event):
+            if not event.is_directory:
+                on_added(event.src_path)
+
+        def on_modified(self, event):
+            if not event.is_directory:
+                on_added(event.src_path)
+
+        def on_deleted(self, event):
+            if not event.is_directory:
+                on_removed(event.src_path)
+
+        def on_moved(self, event):
+            if not event.is_directory:
+                on_removed(event.src_path)
+                if os.path.dirname(os.path.abspath(event.dest_path)) == root:
+                    on_added(event.dest_path)
+
+    observer = Observer()
+    observer.daemon = True
+    observer.schedule(Handler(), folder, recursive=False)
+    observer.start()
+    (log or logging.getLogger(__name__)).debug(f"Observing {folder}")
+    return observer